@@ -1,3 +1,32 @@
 # H5Compare/abort_flag.py
+import multiprocessing
 
-ABORT = False # Shared abort flag for graceful exit
+# Shared abort flag for graceful exit. It lives in shared memory so that setting it in the
+# main process (GUI stop button, SIGINT/SIGTERM) is seen by process-pool workers as well;
+# hashing and dataset loops check it once per block.
+_flag = multiprocessing.RawValue("b", 0)
+
+class Aborted(Exception):
+    pass
+
+def set():
+    _flag.value = 1
+
+def clear():
+    _flag.value = 0
+
+def is_set():
+    return _flag.value != 0
+
+def check():
+    # Call between blocks of work; unwinds the task with Aborted
+    if _flag.value:
+        raise Aborted()
+
+def shared():
+    return _flag
+
+def init_worker(flag):
+    # ProcessPoolExecutor initializer: attach to the parent's flag (needed with spawn, e.g. Windows)
+    global _flag
+    _flag = flag
@@ -0,0 +1,178 @@
+# H5Compare/agent.py
+import json
+import os
+import socket
+import socketserver
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+
+# Ensure parent folder is in sys.path so absolute imports work
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from H5Compare import abort_flag  # <-- shared abort flag
+from H5Compare.config import HASH_ALGO, LOCAL_IO_THREADS, MAX_IN_FLIGHT, AGENT_PORT, AGENT_BIND
+from H5Compare.utils import collect_h5_files, file_record
+from H5Compare.cache import cached_file_hash, cached_h5_digests
+from H5Compare.manifest import ManifestRecord
+from H5Compare.scheduler import bounded_map, largest_first
+
+# Hashing agent, run next to the data (e.g. on the NAS host) so file bytes never cross the network:
+#   python -m H5Compare.agent <root> [--agent-port=8765] [--agent-bind=0.0.0.0]
+# and compare against it with:
+#   python -m H5Compare.main <local root> agent://nas-host:8765
+#
+# Protocol: one JSON request line per connection, answered by JSON lines and a final {"done": true}
+# (or {"error": ...}). Paths are relative to the agent's root and use "/".
+#   {"op": "list"}                               -> {"path", "size", "mtime_ns"} per .h5 file
+#   {"op": "hash", "algo": a, "paths": [...]}    -> {"path", "digest"} per file, in completion order
+#                                                   (digest None and "failed" if it could not be read)
+#   {"op": "datasets", "algo": a, "path": p}     -> {"path", "datasets": {dataset: digest}}
+AGENT_SCHEME = "agent://"
+PROTOCOL_VERSION = 1
+
+def is_agent(root):
+    return isinstance(root, str) and root.startswith(AGENT_SCHEME)
+
+def _dump(obj):
+    return (json.dumps(obj, separators=(",", ":")) + "\n").encode()
+
+def _size(path):
+    # Scheduling order only; a file that cannot be stat'ed is reported by hash_one
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class AgentHandler(socketserver.StreamRequestHandler):
+    def resolve(self, rel):
+        # Absolute path of a request path; nothing outside the served root
+        root = self.server.root
+        path = os.path.realpath(os.path.join(root, *rel.split("/")))
+        if not path.startswith(root + os.sep):
+            raise ValueError(f"Path outside served root: {rel}")
+        return path
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            op = request.get("op")
+            if op == "list":
+                for rel, rec in collect_h5_files(self.server.root).items():
+                    self.wfile.write(_dump({"path": rel.replace(os.sep, "/"), "size": rec.size,
+                                            "mtime_ns": rec.mtime_ns}))
+            elif op == "hash":
+                algo = request.get("algo", HASH_ALGO)
+                jobs = largest_first([(rel, self.resolve(rel)) for rel in request["paths"]],
+                                     cost=lambda job: _size(job[1]))
+                for reply in bounded_map(self.server.pool, self.hash_one, [(*job, algo) for job in jobs],
+                                         MAX_IN_FLIGHT):
+                    self.wfile.write(_dump(reply))
+            elif op == "datasets":
+                algo = request.get("algo", HASH_ALGO)
+                datasets = cached_h5_digests(self.resolve(request["path"]), "local", algo)
+                self.wfile.write(_dump({"path": request["path"], "datasets": datasets}))
+            else:
+                raise ValueError(f"Unknown op: {op}")
+            self.wfile.write(_dump({"done": True, "version": PROTOCOL_VERSION}))
+        except Exception as e:
+            self.wfile.write(_dump({"error": str(e)}))
+
+    @staticmethod
+    def hash_one(rel, path, algo):
+        # Plain file digests (no tree hash) so they equal the workstation's for any --split-mb
+        try:
+            record = file_record(path)  # <-- a file gone since the listing fails here, on its own
+            return {"path": rel, "digest": cached_file_hash(record, "local", algo, split=False)[0]}
+        except OSError as e:
+            return {"path": rel, "digest": None, "failed": str(e)}  # <-- one unreadable file, not the request
+
+class AgentServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, address):
+        super().__init__(address, AgentHandler)
+        self.root = os.path.realpath(root)
+        self.pool = ThreadPoolExecutor(max_workers=LOCAL_IO_THREADS)  # <-- shared by all connections
+
+def serve(root, port=AGENT_PORT, bind=AGENT_BIND):
+    with AgentServer(root, (bind, port)) as server:
+        print(f"Serving digests of {server.root} on {bind}:{server.server_address[1]}", flush=True)
+        server.serve_forever()
+
+class AgentClient:
+    def __init__(self, url, timeout=60):
+        host, _, port = url[len(AGENT_SCHEME):].rstrip("/").partition(":")
+        self.address = (host, int(port or AGENT_PORT))
+        self.timeout = timeout
+
+    def request(self, op, **args):
+        # Yields the response lines; a connection per request, so threads and processes can share a client
+        with socket.create_connection(self.address, timeout=self.timeout) as sock:
+            sock.settimeout(None)  # <-- hashing a large file takes longer than any sensible timeout
+            with sock.makefile("rwb") as f:
+                f.write(_dump({"op": op, **args}))
+                f.flush()
+                for line in f:
+                    reply = json.loads(line)
+                    if "error" in reply:
+                        raise RuntimeError(f"Agent {self.address[0]}:{self.address[1]}: {reply['error']}")
+                    if reply.get("done"):
+                        return
+                    yield reply
+        raise ConnectionError(f"Agent {self.address[0]}:{self.address[1]} closed the connection")
+
+    def records(self):
+        # {rel_path (os.sep): ManifestRecord without digest} -- same shape as collect_h5_files
+        return {e["path"].replace("/", os.sep): ManifestRecord(e["path"], e["size"], e["mtime_ns"], 0, None, None)
+                for e in self.request("list")}
+
+    def datasets(self, path, algo=HASH_ALGO):
+        return next(self.request("datasets", algo=algo, path=path))["datasets"]
+
+class RemoteDigests:
+    # File digests streamed from the agent in one bulk request while local hashing runs;
+    # digest() blocks until the requested path has arrived
+    def __init__(self, client, paths, algo=HASH_ALGO):
+        self.digests, self.error, self.done = {}, None, False
+        self.cond = Condition()
+        self.thread = Thread(target=self.fetch, args=(client, list(paths), algo), daemon=True)
+        self.thread.start()
+
+    def fetch(self, client, paths, algo):
+        try:
+            for reply in client.request("hash", algo=algo, paths=paths):
+                with self.cond:
+                    self.digests[reply["path"]] = reply["digest"] or OSError(reply.get("failed"))
+                    self.cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+
+    def digest(self, path):
+        with self.cond:
+            while path not in self.digests:
+                if self.error is not None:
+                    raise self.error
+                if self.done:
+                    raise KeyError(f"Agent returned no digest for {path}")
+                self.cond.wait(timeout=0.2)
+                abort_flag.check()
+            digest = self.digests[path]
+        if isinstance(digest, OSError):
+            raise digest
+        return digest
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if not args:
+        print("Usage: python -m H5Compare.agent <root> [--agent-port=8765] [--agent-bind=127.0.0.1] [--hash-algo=...]")
+        sys.exit(1)
+    try:
+        serve(args[0])
+    except KeyboardInterrupt:
+        pass
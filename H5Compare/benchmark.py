@@ -0,0 +1,232 @@
+# H5Compare/benchmark.py
+import argparse
+import builtins
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+from . import utils, synth
+
+class ThrottledFile:
+    # Slow-storage stand-in: caps read throughput of a local file at `mbps`
+    def __init__(self, f, mbps):
+        self.f = f
+        self.rate = mbps * 1024 * 1024
+
+    def readinto(self, buf):
+        n = self.f.readinto(buf)
+        time.sleep(n / self.rate)
+        return n
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        time.sleep(len(data) / self.rate)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.f.seek(offset, whence)  # <-- read_blocks starts at its byte range
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+def throttled_open(rates):
+    # rates: {directory: MB/s}; files outside those directories are not throttled
+    def opener(path, mode="r", *args, **kwargs):
+        f = builtins.open(path, mode, *args, **kwargs)
+        for root, mbps in rates.items():
+            if mbps and os.path.abspath(path).startswith(os.path.abspath(root) + os.sep):
+                return ThrottledFile(f, mbps)
+        return f
+    return opener
+
+def serial_hash_pair(file1, file2, opener, algo="md5", block_size=4*1024*1024):
+    # Previous behaviour: hash one side completely, then the other, without read-ahead
+    digests = []
+    for path in (file1, file2):
+        h = hashlib.new(algo)
+        with opener(path, "rb") as f:
+            while chunk := f.read(block_size):
+                h.update(chunk)
+        digests.append(h.hexdigest())
+    return tuple(digests)
+
+def bench_pipeline(size_mb, local_mbps, remote_mbps, repeats):
+    tmp = tempfile.mkdtemp(prefix="h5compare_bench_")
+    local_dir, remote_dir = os.path.join(tmp, "local"), os.path.join(tmp, "remote")
+    os.makedirs(local_dir)
+    os.makedirs(remote_dir)
+    f_local, f_remote = os.path.join(local_dir, "data.h5"), os.path.join(remote_dir, "data.h5")
+    with open(f_local, "wb") as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    shutil.copyfile(f_local, f_remote)
+
+    opener = throttled_open({local_dir: local_mbps, remote_dir: remote_mbps})
+    utils.open = opener  # <-- read_blocks resolves `open` from the utils module first
+    try:
+        runs = {
+            "serial (before)": lambda: serial_hash_pair(f_local, f_remote, opener),
+            "overlapped hash": lambda: utils.hash_pair(f_local, f_remote),
+            "overlapped direct": lambda: utils.direct_compare(f_local, f_remote),
+        }
+        print(f"File size {size_mb} MB, local {local_mbps or 'unthrottled'} MB/s, "
+              f"remote {remote_mbps or 'unthrottled'} MB/s, best of {repeats}")
+        for name, run in runs.items():
+            best = min(_timed(run) for _ in range(repeats))
+            print(f"  {name:<20} {best:8.3f} s per file  ({2 * size_mb / best:8.1f} MB/s combined)")
+    finally:
+        del utils.open
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def bench_hashing(directory, size_mb, algos, block_sizes_mb, repeats):
+    fd, path = tempfile.mkstemp(prefix="h5compare_bench_", suffix=".bin", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    try:
+        data = memoryview(os.urandom(min(size_mb, 64) * 1024 * 1024))
+        print(f"Hash CPU only ({len(data) // 1024**2} MB in memory):")
+        for algo in algos:
+            best = min(_timed(lambda: hashlib.new(algo, data)) for _ in range(repeats))
+            print(f"  {algo:<10} {len(data) / 1024**2 / best:9.1f} MB/s")
+
+        # After the first pass the file is page-cached, so this measures the read path, not the disk
+        print(f"\nFile hashing ({path}, best of {repeats}):")
+        results = []
+        for use_mmap in (False, True):
+            for block_mb in block_sizes_mb:
+                for algo in algos:
+                    best = min(_timed(lambda: utils.file_hash(path, algo, block_mb * 1024 * 1024, use_mmap))
+                               for _ in range(repeats))
+                    results.append((size_mb / best, algo, block_mb, use_mmap))
+                    print(f"  {'mmap' if use_mmap else 'read':<5} {block_mb:>3} MB blocks  {algo:<10} "
+                          f"{size_mb / best:9.1f} MB/s")
+        mbps, algo, block_mb, use_mmap = max(results)
+        print(f"\nFastest: --hash-algo={algo} --block-mb={block_mb}{' --mmap' if use_mmap else ''} "
+              f"({mbps:.1f} MB/s)")
+    finally:
+        os.remove(path)
+
+def version_label():
+    # git describe of the checkout being measured, so saved results line up with versions
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(__file__),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unversioned"
+
+def bench_suite(corpus, out_dir, label, repeats, corpus_kwargs):
+    # Times the main entry points on a synthetic corpus (generated unless an existing one is given)
+    # and saves <out_dir>/<label>.json; the newest earlier result is shown alongside for regressions
+    from . import main, cache, comparator, diffengine  # <-- main installs signal handlers on import
+
+    tmp = None
+    if corpus is None:
+        tmp = corpus = tempfile.mkdtemp(prefix="h5compare_corpus_")
+        synth.generate(corpus, **corpus_kwargs)
+    info = synth.load_corpus(corpus)
+    local_root, remote_root = os.path.join(corpus, "local"), os.path.join(corpus, "remote")
+    pairs = [(rel, utils.file_record(os.path.join(local_root, rel)), utils.file_record(os.path.join(remote_root, rel)))
+             for rel in info["files"]]
+    mb = sum(rec.size for _, rec, _ in pairs) / 1e6
+
+    report = tempfile.mkdtemp(prefix="h5compare_report_")
+    saved = main.REPORT_FILE, main.RESULTS_FILE, main.CHECKPOINT_FILE, cache.USE_CACHE
+    main.REPORT_FILE, main.RESULTS_FILE, main.CHECKPOINT_FILE = os.path.join(report, "report.txt"), "", ""
+    cache.USE_CACHE = False  # <-- a warm hash cache would time SQLite lookups, not the comparison
+    timings = {}
+    print(f"{len(pairs)} file pairs, {mb:.1f} MB per side, best of {repeats}")
+    try:
+        runs = {
+            "run_comparison": (lambda: main.run_comparison(local_root, remote_root), 2 * mb),
+            "compare_file_task": (lambda: [comparator.compare_file_task(*p) for p in pairs], 2 * mb),
+            "file_hash": (lambda: [utils.file_hash(rec.path) for _, rec, _ in pairs], mb),
+            "diff_h5": (lambda: [diffengine.diff_h5(l.path, r.path) for _, l, r in pairs], 2 * mb),
+        }
+        for name, (run, run_mb) in runs.items():
+            with contextlib.redirect_stdout(io.StringIO()):  # <-- report lines from run_comparison
+                best = min(_timed(run) for _ in range(repeats))
+            timings[name] = {"best_s": best, "mb_s": run_mb / best}
+            print(f"  {name:<18} {best:8.3f} s  ({run_mb / best:8.1f} MB/s)")
+
+        # The corpus knows what diff_h5 should say about every pair
+        wrong = [rel for rel, l, r in pairs
+                 if ("DIFFERENT" if diffengine.diff_h5(l.path, r.path) else "OK") != info["files"][rel]["expected"]]
+        if wrong:
+            print(f"  {len(wrong)} unexpected verdict(s): {', '.join(wrong[:5])}")
+    finally:
+        main.REPORT_FILE, main.RESULTS_FILE, main.CHECKPOINT_FILE, cache.USE_CACHE = saved
+        shutil.rmtree(report, ignore_errors=True)
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    os.makedirs(out_dir, exist_ok=True)
+    previous = []
+    for name in os.listdir(out_dir):
+        if name.endswith(".json") and name != f"{label}.json":
+            with open(os.path.join(out_dir, name), encoding="utf-8") as f:
+                previous.append(json.load(f))
+    result = {"label": label, "timestamp": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "platform": platform.platform(), "corpus": info["spec"],
+              "mb_per_side": mb, "timings": timings, "unexpected_verdicts": wrong}
+    with open(os.path.join(out_dir, f"{label}.json"), "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    previous = [p for p in previous if p["corpus"] == info["spec"]]  # <-- only like-for-like runs
+    if previous:
+        last = max(previous, key=lambda p: p["timestamp"])
+        print(f"\nAgainst {last['label']} ({last['timestamp']}):")
+        for name, t in timings.items():
+            if name in last["timings"]:
+                change = t["best_s"] / last["timings"][name]["best_s"] - 1
+                flag = "  <-- slower" if change > 0.10 else ""
+                print(f"  {name:<18} {change:+7.1%}{flag}")
+
+def _timed(run):
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="H5Compare benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("pipeline", help="per-file wall time, serial vs overlapped local/remote reads")
+    p.add_argument("--size-mb", type=int, default=128)
+    p.add_argument("--local-mbps", type=float, default=400, help="0 = unthrottled")
+    p.add_argument("--remote-mbps", type=float, default=100, help="0 = unthrottled")
+    p.add_argument("--repeats", type=int, default=3)
+    p = sub.add_parser("hashing", help="MB/s per hash algorithm, block size and read method")
+    p.add_argument("--dir", default=None, help="directory on the storage to measure (default: temp dir)")
+    p.add_argument("--size-mb", type=int, default=256)
+    p.add_argument("--algos", default="md5,sha1,blake2b,blake2s,sha256")
+    p.add_argument("--block-sizes", default="1,4,16,64", help="MB; not --block-mb, which config parses as one number")
+    p.add_argument("--repeats", type=int, default=3)
+    p = sub.add_parser("suite", help="time the comparison entry points on a synthetic corpus")
+    p.add_argument("--corpus", default=None, help="existing synth corpus (default: generate into a temp dir)")
+    p.add_argument("--out", default="benchmarks", help="folder of saved results, one JSON per version")
+    p.add_argument("--label", default=None, help="name for this result (default: git describe)")
+    p.add_argument("--repeats", type=int, default=3)
+    synth.add_corpus_args(p)
+    args = parser.parse_args()
+
+    if args.bench == "pipeline":
+        bench_pipeline(args.size_mb, args.local_mbps, args.remote_mbps, args.repeats)
+    elif args.bench == "hashing":
+        bench_hashing(args.dir, args.size_mb, args.algos.split(","),
+                      [int(b) for b in args.block_sizes.split(",")], args.repeats)
+    elif args.bench == "suite":
+        bench_suite(args.corpus, args.out, args.label or version_label(), args.repeats, synth.corpus_kwargs(args))
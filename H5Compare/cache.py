@@ -0,0 +1,193 @@
+# H5Compare/cache.py
+import json
+import os
+import sys
+import sqlite3
+import time
+import threading
+
+from .config import CACHE_FILE, USE_CACHE, HASH_ALGO, LOCAL_MMAP, SEGMENT_MB
+from .utils import file_hash, tree_hash, h5_digests, run_pair, stat_key, DEVICES, SPLIT_BYTES
+
+# file_hash: digest of the file bytes. dataset_hash: JSON {dataset: digest} of the logical content
+# (utils.dataset_digest), which stays equal when a file is repacked or rewritten with other chunking
+TABLES = ("file_hash", "dataset_hash")
+
+SCHEMA = "".join(f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    side     TEXT    NOT NULL,
+    path     TEXT    NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode    INTEGER NOT NULL,
+    algo     TEXT    NOT NULL,
+    digest   TEXT    NOT NULL,
+    checked  REAL    NOT NULL,
+    PRIMARY KEY (side, path)
+);
+""" for table in TABLES)
+
+class HashCache:
+    # Digest per (side, path) and table, valid only while size + mtime + inode are unchanged
+
+    def __init__(self, db_path=CACHE_FILE):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")  # <-- workers read while others write
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    @staticmethod
+    def stat_key(path):
+        return stat_key(os.stat(path))
+
+    def get(self, side, path, algo=HASH_ALGO, key=None, table="file_hash"):
+        path = os.path.abspath(path)
+        size, mtime_ns, inode = key or self.stat_key(path)
+        row = self.conn.execute(
+            f"SELECT size, mtime_ns, inode, algo, digest FROM {table} WHERE side=? AND path=?",
+            (side, path)).fetchone()
+        if row is None:
+            return None
+        if row[:4] != (size, mtime_ns, inode, algo):
+            return None
+        return row[4]
+
+    def put(self, side, path, digest, key, algo=HASH_ALGO, table="file_hash"):
+        size, mtime_ns, inode = key
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (side, os.path.abspath(path), size, mtime_ns, inode, algo, digest, time.time()))
+
+    def invalidate(self, side=None, prefix=None):
+        # Drop entries for one side and/or everything under a path prefix
+        where, args = "1=1", []
+        if side:
+            where += " AND side=?"
+            args.append(side)
+        if prefix:
+            prefix = os.path.abspath(prefix)
+            where += " AND substr(path, 1, ?) = ?"
+            args += [len(prefix), prefix]
+        return sum(self.conn.execute(f"DELETE FROM {table} WHERE {where}", args).rowcount for table in TABLES)
+
+    def prune(self):
+        # Remove entries whose file is gone or whose stat no longer matches
+        removed = 0
+        for table in TABLES:
+            stale = []
+            for side, path, size, mtime_ns, inode in self.conn.execute(
+                    f"SELECT side, path, size, mtime_ns, inode FROM {table}").fetchall():
+                try:
+                    if self.stat_key(path) != (size, mtime_ns, inode):
+                        stale.append((side, path))
+                except OSError:
+                    stale.append((side, path))
+            self.conn.executemany(f"DELETE FROM {table} WHERE side=? AND path=?", stale)
+            removed += len(stale)
+        self.conn.execute("VACUUM")
+        return removed
+
+    def close(self):
+        self.conn.close()
+
+_local = threading.local()  # one connection per worker process / reader thread
+
+def get_cache():
+    if getattr(_local, "cache", None) is None:
+        _local.cache = HashCache()
+    return _local.cache
+
+def lookup_file_hash(record, side, algo=HASH_ALGO):
+    # Cached digest if still valid, without ever reading the file
+    if not USE_CACHE:
+        return None
+    return get_cache().get(side, record.path, hash_key(record, algo), record[1:])
+
+def hash_key(record, algo=HASH_ALGO, split=True):
+    # Large files get a tree hash (utils.tree_hash), stored under its own algo name
+    return f"{algo}/tree{SEGMENT_MB}" if split and record.size >= SPLIT_BYTES else algo
+
+def read_file_hash(record, side, algo=HASH_ALGO, split=True):
+    if split and record.size >= SPLIT_BYTES:
+        return tree_hash(record.path, algo, side)  # <-- takes a read slot per segment
+    with DEVICES[side] as device:
+        return file_hash(record.path, algo, use_mmap=LOCAL_MMAP and side == "local", device=device)
+
+def cached_file_hash(record, side, algo=HASH_ALGO, split=True):
+    # (digest, bytes read); a cache hit reads nothing. split=False always gives the plain
+    # file digest, e.g. for manifests read by hosts that may use another --split-mb.
+    if not USE_CACHE:
+        return read_file_hash(record, side, algo, split), record.size
+
+    cache = get_cache()
+    key = tuple(record[1:])  # <-- stat captured by the directory walk
+    stored_algo = hash_key(record, algo, split)
+    digest = cache.get(side, record.path, stored_algo, key)
+    if digest is not None:
+        return digest, 0
+
+    digest = read_file_hash(record, side, algo, split)
+    # Only store if the file did not change while it was being read
+    if HashCache.stat_key(record.path) == key:
+        cache.put(side, record.path, digest, key, stored_algo)
+    return digest, record.size
+
+def timed_file_hash(record, side, algo=HASH_ALGO):
+    # (digest, bytes read, seconds) for the per-side throughput figures
+    start = time.perf_counter()
+    digest, read = cached_file_hash(record, side, algo)
+    return digest, read, time.perf_counter() - start
+
+def cached_hash_pair(rec_local, rec_remote, algo=HASH_ALGO):
+    return run_pair(lambda: timed_file_hash(rec_local, "local", algo),
+                    lambda: timed_file_hash(rec_remote, "remote", algo))
+
+def read_h5_digests(path, side, algo=HASH_ALGO):
+    with DEVICES[side] as device:
+        digests = h5_digests(path, algo)
+    device.take(os.path.getsize(path))  # <-- charged afterwards: h5py does its own reads
+    return digests
+
+def cached_h5_digests(path, side, algo=HASH_ALGO):
+    # {dataset: digest} for one file; recomputed only when the file's stat changed
+    if not USE_CACHE:
+        return read_h5_digests(path, side, algo)
+
+    cache = get_cache()
+    key = HashCache.stat_key(path)
+    digests = cache.get(side, path, algo, key, table="dataset_hash")
+    if digests is not None:
+        return json.loads(digests)
+
+    digests = read_h5_digests(path, side, algo)
+    if HashCache.stat_key(path) == key:
+        cache.put(side, path, json.dumps(digests), key, algo, table="dataset_hash")
+    return digests
+
+def cached_digest_pair(f_local, f_remote, algo=HASH_ALGO):
+    return run_pair(lambda: cached_h5_digests(f_local, "local", algo),
+                    lambda: cached_h5_digests(f_remote, "remote", algo))
+
+def lookup_h5_digests(path, side, algo=HASH_ALGO):
+    # Cached {dataset: digest} if still valid, without ever reading the file
+    if not USE_CACHE:
+        return None
+    digests = get_cache().get(side, path, algo, table="dataset_hash")
+    return None if digests is None else json.loads(digests)
+
+if __name__ == "__main__":
+    # python -m H5Compare.cache prune | clear [side] | invalidate <path-prefix>
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "prune"
+    cache = HashCache()
+    if cmd == "prune":
+        print(f"Pruned {cache.prune()} stale entries from {cache.db_path}")
+    elif cmd == "clear":
+        side = sys.argv[2] if len(sys.argv) > 2 else None
+        print(f"Removed {cache.invalidate(side=side)} entries from {cache.db_path}")
+    elif cmd == "invalidate" and len(sys.argv) > 2:
+        print(f"Removed {cache.invalidate(prefix=sys.argv[2])} entries from {cache.db_path}")
+    else:
+        print("Usage: python -m H5Compare.cache prune | clear [local|remote] | invalidate <path-prefix>")
+        sys.exit(1)
+    cache.close()
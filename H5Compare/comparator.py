@@ -1,49 +1,378 @@
 # H5Compare/comparator.py
-import os
-from .utils import file_hash, run_h5diff, compare_h5
-from .config import USE_H5DIFF
+import time
+from collections import namedtuple
+from .utils import run_h5diff, direct_compare, compare_range, split_direct_compare, compare_digests, DEVICES, BLOCK_SIZE, SPLIT_BYTES, SEGMENT_BYTES
+from .diffengine import diff_h5, render, plan_parts, diff_region, data_difference
+from .cache import cached_hash_pair, cached_file_hash, lookup_file_hash, lookup_h5_digests, cached_h5_digests, cached_digest_pair
+from .config import USE_H5DIFF, COMPARE_MODE, DATASET_DIGESTS, RTOL, ATOL, SAMPLE_RANGES
+from .sampling import file_rng, sample_ranges, sample_parts
+from .results import Result, OK, DIFFERENT, DIFFERENT_SIZE, ERROR, ABORTED
 from H5Compare import abort_flag  # <-- shared abort flag
 
-def compare_file_task(rel_path, f_local, f_remote):
+# Arguments for the deep stage: the remote side is a path or a manifest entry;
+# res is the partly filled Result from the byte-level stage
+DeepJob = namedtuple("DeepJob", "rel_path f_local f_remote res")
+
+# Outcome of deep_part_task for one (dataset, region) of a SplitJob; error is None or a message
+PartResult = namedtuple("PartResult", "dataset size stats seconds error")
+
+def apply_diffs(res, diffs):
+    # Fill a Result from diffengine differences
+    res.status, res.detail = DIFFERENT, "\n".join(render(d) for d in diffs)
+    res.diffs = [d._asdict() for d in diffs]
+    data = next((d for d in diffs if d.kind == "data"), None)
+    if data and not res.first_diff:
+        res.first_diff = f"{data.path}[{', '.join(map(str, data.stats['first_index']))}]"
+    return res
+
+class SplitJob:
+    # Deep comparison of one large file spread over the process pool as dataset hyperslabs.
+    # compare_jobs submits deep_part_task for every part and feeds the outcomes to add().
+    def __init__(self, rel_path, f_local, f_remote, res, parts, rtol=RTOL, atol=ATOL, method="deep match via Python"):
+        self.rel_path, self.f_local, self.f_remote, self.res, self.parts = rel_path, f_local, f_remote, res, parts
+        self.rtol, self.atol, self.method = rtol, atol, method
+        self.pending = len(parts)
+        self.stats = {}  # dataset -> (size, merged MismatchStats)
+        self.errors = []
+
+    def tasks(self):
+        return [(deep_part_task, self.f_local, self.f_remote, dataset, region, self.rtol, self.atol)
+                for dataset, region in self.parts]
+
+    def add(self, part):
+        # True once every part is in
+        self.pending -= 1
+        self.res.add_time("deep", part.seconds)
+        if part.error:
+            self.errors.append(part.error)
+        elif part.dataset in self.stats:
+            self.stats[part.dataset][1].merge(part.stats)
+        else:
+            self.stats[part.dataset] = (part.size, part.stats)
+        return self.pending == 0
+
+    def result(self):
+        res = self.res
+        diffs = [d for path, (size, stats) in sorted(self.stats.items()) for d in data_difference(path, stats, size)]
+        if abort_flag.is_set() or ABORTED in self.errors:
+            res.status = ABORTED
+        elif self.errors:
+            res.status, res.detail = ERROR, self.errors[0]
+        elif diffs:
+            apply_diffs(res, diffs)
+        else:
+            res.status, res.method = OK, f"{self.method} ({len(self.parts)} parts)"
+        return res
+
+def deep_part_task(f_local, f_remote, dataset, region, rtol=RTOL, atol=ATOL):
+    # Process-pool entry point for one part of a SplitJob
+    if abort_flag.is_set():
+        return PartResult(dataset, 0, None, 0.0, ABORTED)
+    start = time.perf_counter()
+    try:
+        stats, size = diff_region(f_local, f_remote, dataset, region, rtol, atol)
+        return PartResult(dataset, size, stats, time.perf_counter() - start, None)
+    except abort_flag.Aborted:
+        return PartResult(dataset, 0, None, time.perf_counter() - start, ABORTED)
+    except Exception as e:
+        return PartResult(dataset, 0, None, time.perf_counter() - start, f"{dataset}: {e}")
+
+def deep_job(rel_path, f_local, f_remote, res, size, rtol=RTOL, atol=ATOL):
+    # DeepJob, or for a large file its parts (SplitJob) after a header-only structure check
+    if USE_H5DIFF or size < SPLIT_BYTES:
+        return DeepJob(rel_path, f_local, f_remote, res)
+    start = time.perf_counter()
+    diffs, parts = plan_parts(f_local, f_remote, SEGMENT_BYTES)
+    res.add_time("plan", time.perf_counter() - start)
+    if diffs:
+        return apply_diffs(res, diffs)
+    if not parts:
+        res.status, res.method = OK, "deep match via Python"
+        return res
+    return SplitJob(rel_path, f_local, f_remote, res, parts, rtol, atol)
+
+def deep_compare(res, f_local, f_remote, rtol=RTOL, atol=ATOL):
+    if USE_H5DIFF:
+        start = time.perf_counter()
+        diff = run_h5diff(f_local, f_remote)
+        res.add_time("h5diff", time.perf_counter() - start)
+        if abort_flag.is_set():
+            res.status = ABORTED
+            return res
+        if diff is True:
+            res.status, res.method = OK, "deep match via h5diff"
+            return res
+        elif diff is False or isinstance(diff, str):
+            res.status, res.detail = DIFFERENT, diff if isinstance(diff, str) else ""
+            return res
+
+    datasets, cached = None, False
+    if DATASET_DIGESTS:
+        # Content digests cached by an earlier deep pass narrow the payload comparison to datasets whose
+        # bits differ; a repacked file whose digests all match needs only the header check
+        digests_local, digests_remote = lookup_h5_digests(f_local, "local"), lookup_h5_digests(f_remote, "remote")
+        cached = digests_local is not None and digests_remote is not None
+        if cached:
+            datasets = {name for name, digest in digests_local.items() if digests_remote.get(name) != digest}
+
+    start = time.perf_counter()
+    diffs = diff_h5(f_local, f_remote, rtol, atol, datasets=datasets)
+    res.add_time("deep", time.perf_counter() - start)
+    if abort_flag.is_set():
+        res.status = ABORTED
+        return res
+    if diffs:
+        apply_diffs(res, diffs)
+    else:
+        res.status, res.method = OK, "dataset digests match" if datasets == set() else "deep match via Python"
+
+    if DATASET_DIGESTS and not cached and all(d.kind == "data" for d in diffs):
+        # First deep pass of this pair (structure equal, payload compared): cache both sides' digests
+        # after the comparison, which kept its raw-chunk shortcut, so the next run with unchanged
+        # stats compares digest tables instead of payload
+        start = time.perf_counter()
+        cached_digest_pair(f_local, f_remote)
+        res.add_time("digest", time.perf_counter() - start)
+    return res
+
+def deep_compare_task(rel_path, f_local, f_remote, res=None, rtol=RTOL, atol=ATOL):
+    # Process-pool entry point for files whose bytes differ
+    res = res or Result(DIFFERENT, rel_path)
+    if abort_flag.is_set():
+        res.status = ABORTED
+        return res
+    try:
+        return deep_compare(res, f_local, f_remote, rtol, atol)
+    except abort_flag.Aborted:
+        res.status = ABORTED
+        return res
+    except Exception as e:
+        res.status, res.detail = ERROR, str(e)
+        return res
+
+def check_file_task(rel_path, rec_local, rec_remote, mode=COMPARE_MODE, rtol=RTOL, atol=ATOL):
+    # Byte-level stage (size, hash or direct compare); I/O bound, runs on the thread pool.
+    # Returns a Result, or a DeepJob / SplitJob when the file needs a deep comparison.
+    # rec_local / rec_remote are utils.FileRecord entries from collect_h5_files
+    res = Result(ABORTED, rel_path)
     # Check abort flag at the very start
-    if abort_flag.ABORT:
-        return f"[ABORTED] {rel_path}"
+    if abort_flag.is_set():
+        return res
 
     try:
-        size_local  = os.path.getsize(f_local)
-        size_remote = os.path.getsize(f_remote)
-        if abort_flag.ABORT: return f"[ABORTED] {rel_path}"
-        if size_local != size_remote:
-            return f"[DIFFERENT SIZE] {rel_path}"
+        f_local, f_remote = rec_local.path, rec_remote.path
+        if rec_local.size != rec_remote.size:
+            res.status = DIFFERENT_SIZE
+            return res
 
-        hash_local  = file_hash(f_local)
-        if abort_flag.ABORT: return f"[ABORTED] {rel_path}"
-        hash_remote = file_hash(f_remote)
-        if abort_flag.ABORT: return f"[ABORTED] {rel_path}"
+        if mode == "direct":
+            # Valid cached digests on both sides settle it without reading either file
+            hash_local, hash_remote = lookup_file_hash(rec_local, "local"), lookup_file_hash(rec_remote, "remote")
+            if hash_local and hash_remote:
+                if hash_local == hash_remote:
+                    res.status, res.method = OK, "cached hash match"
+                    return res
+                return deep_job(rel_path, f_local, f_remote, res, rec_local.size, rtol, atol)
 
-        if hash_local == hash_remote:
-            return f"[OK] {rel_path} (hash match)"
-
-        if USE_H5DIFF:
-            result = run_h5diff(f_local, f_remote)
-            if abort_flag.ABORT: return f"[ABORTED] {rel_path}"
-            if result is True:
-                return f"[OK] {rel_path} (deep match via h5diff)"
-            elif result is False or isinstance(result, str):
-                return f"[DIFFERENT] {rel_path}\n{result if isinstance(result,str) else ''}"
+            start = time.perf_counter()
+            if rec_local.size >= SPLIT_BYTES:
+                offset = split_direct_compare(f_local, f_remote)  # <-- takes read slots per segment
             else:
-                diff_msg = compare_h5(f_local, f_remote)
-                if abort_flag.ABORT: return f"[ABORTED] {rel_path}"
-                if diff_msg:
-                    return f"[DIFFERENT] {rel_path}\n{diff_msg}"
-                else:
-                    return f"[OK] {rel_path} (deep match via Python)"
+                with DEVICES["local"] as local, DEVICES["remote"] as remote:  # <-- always local first, no deadlock
+                    offset = direct_compare(f_local, f_remote, devices=(local, remote))
+            elapsed = time.perf_counter() - start
+            res.add_time("direct", elapsed)
+            # Both sides up to the end of the block holding the first difference (read-ahead not counted)
+            read = rec_local.size if offset is None else min(rec_local.size, (offset // BLOCK_SIZE + 1) * BLOCK_SIZE)
+            res.bytes_read = 2 * read
+            for side in ("local", "remote"):  # <-- lockstep: both sides read for the whole phase
+                res.add_time(f"io_{side}", elapsed)
+                res.side_bytes[side] = read
+            if abort_flag.is_set():
+                return res
+            if offset is None:
+                res.status, res.method = OK, "byte match"
+                return res
+            res.first_diff = f"byte {offset}"
+            return deep_job(rel_path, f_local, f_remote, res, rec_local.size, rtol, atol)
+
+        # Local and remote are read concurrently
+        start = time.perf_counter()
+        (hash_local, read_local, t_local), (hash_remote, read_remote, t_remote) = cached_hash_pair(rec_local, rec_remote)
+        res.add_time("hash", time.perf_counter() - start)
+        res.add_time("io_local", t_local)
+        res.add_time("io_remote", t_remote)
+        res.bytes_read = read_local + read_remote
+        res.side_bytes = {"local": read_local, "remote": read_remote}
+        if abort_flag.is_set():
+            return res
+
+        if hash_local == hash_remote:
+            res.status, res.method = OK, "hash match"
+            return res
+
+        return deep_job(rel_path, f_local, f_remote, res, rec_local.size, rtol, atol)
+    except abort_flag.Aborted:
+        res.status = ABORTED
+        return res
+    except Exception as e:
+        res.status, res.detail = ERROR, str(e)
+        return res
+
+def check_sample_task(rel_path, rec_local, rec_remote, seed, ranges=SAMPLE_RANGES, rtol=RTOL, atol=ATOL):
+    # Spot check (sampling.Sample): a few seeded random byte ranges instead of the whole file; where
+    # they differ, the same number of random hyperslabs per dataset decides against the tolerances
+    res = Result(ABORTED, rel_path)
+    if abort_flag.is_set():
+        return res
+    try:
+        f_local, f_remote = rec_local.path, rec_remote.path
+        if rec_local.size != rec_remote.size:
+            res.status = DIFFERENT_SIZE
+            return res
+
+        rng = file_rng(seed, rel_path)
+        start = time.perf_counter()
+        read, offset = 0, None
+        for range_start, length in sample_ranges(rec_local.size, ranges, rng):
+            offset = compare_range(f_local, f_remote, range_start, length)
+            read += length
+            if offset is not None:
+                break
+        elapsed = time.perf_counter() - start
+        res.add_time("sample", elapsed)
+        res.bytes_read = 2 * read
+        for side in ("local", "remote"):
+            res.add_time(f"io_{side}", elapsed)
+            res.side_bytes[side] = read
+        if abort_flag.is_set():
+            return res
+        if offset is None:
+            res.status, res.method = OK, f"sampled match, {read / max(1, rec_local.size):.1%} of bytes"
+            return res
+
+        res.first_diff = f"byte {offset}"
+        start = time.perf_counter()
+        diffs, parts = plan_parts(f_local, f_remote, BLOCK_SIZE)
+        res.add_time("plan", time.perf_counter() - start)
+        if diffs:
+            return apply_diffs(res, diffs)
+        if not parts:
+            res.status, res.method = OK, "sampled deep match via Python"
+            return res
+        return SplitJob(rel_path, f_local, f_remote, res, sample_parts(parts, ranges, rng), rtol, atol,
+                        method="sampled deep match via Python")
+    except abort_flag.Aborted:
+        res.status = ABORTED
+        return res
+    except Exception as e:
+        res.status, res.detail = ERROR, str(e)
+        return res
+
+def check_manifest_task(rel_path, rec_local, entry, algo):
+    # Byte-level stage against a manifest entry (manifest.ManifestRecord) instead of a remote file
+    res = Result(ABORTED, rel_path)
+    if abort_flag.is_set():
+        return res
+    try:
+        if rec_local.size != entry.size:
+            res.status = DIFFERENT_SIZE
+            return res
+        start = time.perf_counter()
+        digest, res.bytes_read = cached_file_hash(rec_local, "local", algo, split=False)
+        elapsed = time.perf_counter() - start
+        res.add_time("hash", elapsed)
+        res.add_time("io_local", elapsed)
+        res.side_bytes["local"] = res.bytes_read
+        if digest == entry.digest:
+            res.status, res.method = OK, "manifest hash match"
+            return res
+        if abort_flag.is_set():
+            return res
+        return DeepJob(rel_path, rec_local.path, entry, res)
+    except abort_flag.Aborted:
+        res.status = ABORTED
+        return res
+    except Exception as e:
+        res.status, res.detail = ERROR, str(e)
+        return res
+
+def check_agent_task(rel_path, rec_local, entry, algo, remote):
+    # Byte-level stage against a hashing agent: entry comes from its listing, the remote digest
+    # from remote (agent.RemoteDigests), hashed next to the data while the local side is read here
+    res = Result(ABORTED, rel_path)
+    if abort_flag.is_set():
+        return res
+    try:
+        if rec_local.size != entry.size:
+            res.status = DIFFERENT_SIZE
+            return res
+        start = time.perf_counter()
+        digest, res.bytes_read = cached_file_hash(rec_local, "local", algo, split=False)
+        elapsed = time.perf_counter() - start
+        res.add_time("io_local", elapsed)
+        res.side_bytes["local"] = res.bytes_read
+        entry = entry._replace(digest=remote.digest(entry.path))
+        res.add_time("hash", time.perf_counter() - start)
+        if digest == entry.digest:
+            res.status, res.method = OK, "agent hash match"
+            return res
+        if abort_flag.is_set():
+            return res
+        return DeepJob(rel_path, rec_local.path, entry, res)
+    except abort_flag.Aborted:
+        res.status = ABORTED
+        return res
+    except Exception as e:
+        res.status, res.detail = ERROR, str(e)
+        return res
+
+def deep_agent_task(rel_path, f_local, entry, res, algo, url):
+    # Dataset digests of the remote file come from the agent; then as for a manifest entry
+    if abort_flag.is_set():
+        res.status = ABORTED
+        return res
+    try:
+        from .agent import AgentClient
+        entry = entry._replace(datasets=AgentClient(url).datasets(entry.path, algo))
+    except Exception as e:
+        res.status, res.detail = ERROR, str(e)
+        return res
+    return deep_manifest_task(rel_path, f_local, entry, res, algo, source="agent")
+
+def deep_manifest_task(rel_path, f_local, entry, res, algo, source="manifest"):
+    # Without the remote file, content can only be checked against per-dataset digests
+    if abort_flag.is_set():
+        res.status = ABORTED
+        return res
+    try:
+        if entry.datasets is None:
+            res.status, res.detail = DIFFERENT, f"File digest differs ({source} has no dataset digests)"
+            return res
+        start = time.perf_counter()
+        diff_msg = compare_digests(cached_h5_digests(f_local, "local", algo), entry.datasets, source)
+        res.add_time("deep", time.perf_counter() - start)
+        if abort_flag.is_set():
+            res.status = ABORTED
+        elif diff_msg:
+            res.status, res.detail = DIFFERENT, diff_msg
         else:
-            diff_msg = compare_h5(f_local, f_remote)
-            if abort_flag.ABORT: return f"[ABORTED] {rel_path}"
-            if diff_msg:
-                return f"[DIFFERENT] {rel_path}\n{diff_msg}"
-            else:
-                return f"[OK] {rel_path} (deep match via Python)"
+            res.status, res.method = OK, f"dataset digests match {source}"
+        return res
+    except abort_flag.Aborted:
+        res.status = ABORTED
+        return res
     except Exception as e:
-        return f"[ERROR] {rel_path}: {e}"
+        res.status, res.detail = ERROR, str(e)
+        return res
+
+def compare_file_task(rel_path, rec_local, rec_remote):
+    # Both stages in one call
+    result = check_file_task(rel_path, rec_local, rec_remote)
+    if isinstance(result, DeepJob):
+        return deep_compare_task(*result)
+    if isinstance(result, SplitJob):
+        for fn, *args in result.tasks():
+            result.add(fn(*args))
+        return result.result()
+    return result
@@ -1,20 +1,69 @@
 # H5Compare/config.py
+import hashlib
 import os
 import sys
+import time
 
 LOCAL_ROOT  = r"D:\Data - Experiment\StructuralPhaseTransition"
 REMOTE_ROOT = r"\\DyLabNAS\Data\StructuralPhaseTransition"
 
-if len(sys.argv) >= 3:
-    LOCAL_ROOT  = sys.argv[1]
-    REMOTE_ROOT = sys.argv[2]
+def _option(name, default):
+    # --name=value on the command line, else default
+    for arg in sys.argv[1:]:
+        if arg.startswith(f"--{name}="):
+            return arg.split("=", 1)[1]
+    return default
+
+_positional = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+if len(_positional) >= 2:
+    LOCAL_ROOT  = _positional[0]
+    REMOTE_ROOT = _positional[1]
 
 GUI_MODE = "--gui" in sys.argv
 
-USE_H5DIFF = True
-RTOL = 1e-6
-ATOL = 1e-12
+USE_H5DIFF = "--h5diff" in sys.argv  # deep compare with an h5diff subprocess per file instead of in-process
+RTOL = float(_option("rtol", 1e-6))
+ATOL = float(_option("atol", 1e-12))
 REPORT_FILE = "comparison_report.txt"
-HASH_ALGO = "md5"
-NUM_WORKERS = os.cpu_count() or 4
+CHECKPOINT_FILE = _option("checkpoint", "comparison_checkpoint.jsonl")  # journal of finished files; "" = off
+RESUME = "--resume" in sys.argv  # skip files the checkpoint journal has verified (unchanged since) and append to the report
+RESULTS_FILE = _option("results", "comparison_results.jsonl")  # .jsonl, or .sqlite/.db for batched inserts; "" = off
+METRICS_FILE = _option("metrics", "")  # .prom (Prometheus textfile) or .json; timing summary is printed either way
+METRICS = "--metrics" in sys.argv or bool(METRICS_FILE)  # per-phase timing and throughput summary
+HASH_ALGO = _option("hash-algo", "md5")  # any hashlib algorithm, e.g. blake2b, sha1
+if HASH_ALGO not in hashlib.algorithms_available or HASH_ALGO.startswith("shake_"):
+    sys.exit(f"Unknown hash algorithm: {HASH_ALGO}")  # <-- shake_* digests need a length, hexdigest() fails
+HASH_BLOCK_MB = int(_option("block-mb", 4))
+LOCAL_MMAP = "--mmap" in sys.argv  # hash local files through mmap instead of read()
+COMPARE_MODE = "direct" if "--direct" in sys.argv else "hash"  # direct = lockstep byte compare, early exit
+NUM_WORKERS = os.cpu_count() or 4  # processes for deep (CPU-bound) comparisons
+LOCAL_IO_THREADS = int(_option("local-readers", 4))     # concurrent readers on the local disk (1-2 for a spinning disk)
+REMOTE_IO_THREADS = int(_option("remote-readers", 16))  # concurrent readers on the NAS (latency bound, oversubscribe)
+LOCAL_MB_S = float(_option("local-mb-s", 0))    # read bandwidth cap per device, shared by all threads and workers; 0 = none
+REMOTE_MB_S = float(_option("remote-mb-s", 0))  # e.g. 100 in the daytime so the NAS stays usable for others
+IO_THREADS = max(LOCAL_IO_THREADS, REMOTE_IO_THREADS)  # threads for size checks and hashing
+MAX_IN_FLIGHT = IO_THREADS * 4  # tasks submitted to a pool at any time
+WALK_WORKERS = 8  # threads scanning folders in parallel (stat latency bound on SMB)
 SIZE_TOL_MB = 5  # allowed difference in total size (MB)
+MEMORY_BUDGET_MB = 256  # per-worker memory for deep dataset comparison
+SPLIT_MB = int(_option("split-mb", 2048))     # files this large are hashed / compared in parallel pieces
+SEGMENT_MB = int(_option("segment-mb", 256))  # size of those pieces (byte ranges, dataset hyperslabs)
+RAW_CHUNK_COMPARE = True  # compare stored (compressed) chunks before decompressing
+
+SAMPLE = float(_option("sample", 0))  # spot check: fraction of file pairs verified (e.g. 0.02 nightly); 0 = full verify
+SAMPLE_SEED = int(_option("seed", time.strftime("%Y%m%d")))  # a new sample every day, repeatable with --seed
+SAMPLE_RANGES = int(_option("sample-ranges", 8))  # byte ranges (and hyperslabs per dataset) read per sampled file
+SAMPLE_HALF_LIFE_DAYS = float(_option("sample-half-life", 7))  # recency bias of the sample fades over this
+SAMPLE_CONFIDENCE = 0.95
+
+WATCH_MODE = "--watch" in sys.argv  # keep running, re-check only files that changed
+WATCH_POLL_S = 10     # seconds between scans when no filesystem notifications are available
+WATCH_SETTLE_S = 30   # a file must be unchanged this long before it is compared (still being written)
+
+AGENT_PORT = int(_option("agent-port", 8765))  # hashing agent (agent.py) next to the remote data
+AGENT_BIND = _option("agent-bind", "127.0.0.1")  # 0.0.0.0 to serve other hosts
+DAEMON_PORT = int(_option("daemon-port", 8766))  # resident comparison daemon (daemon.py), loopback only
+
+USE_CACHE = "--no-cache" not in sys.argv
+CACHE_FILE = os.path.join(os.path.expanduser("~"), ".h5compare_cache.sqlite")
+DATASET_DIGESTS = USE_CACHE and "--no-dataset-digests" not in sys.argv  # cache per-dataset content digests in the deep stage; later runs skip datasets whose digests match
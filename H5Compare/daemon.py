@@ -0,0 +1,238 @@
+# H5Compare/daemon.py
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import time
+from collections import Counter
+from dataclasses import asdict
+from datetime import datetime
+from itertools import count
+from queue import Queue
+from threading import Event, Lock, Thread
+
+# Ensure parent folder is in sys.path so absolute imports work
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from H5Compare import abort_flag  # <-- stops the whole daemon; one job is stopped with its own event
+from H5Compare import devices
+from H5Compare.config import (COMPARE_MODE, RTOL, ATOL, NUM_WORKERS, IO_THREADS, MAX_IN_FLIGHT, DAEMON_PORT,
+                              REPORT_FILE, RESULTS_FILE)
+from H5Compare.logger import log_writer
+from H5Compare.results import Result, open_result_writer
+
+# Resident comparison service: the thread and process pools, the workers' h5py/numpy imports and the
+# hash cache connections stay warm between jobs, so a repeated comparison starts with the folder walk.
+#   python -m H5Compare.daemon serve [--daemon-port=8766]
+#   python -m H5Compare.daemon submit <local root> <remote root> [--direct] [--rtol=..] [--atol=..]
+# submit writes the usual report and results file; "status" lists the running jobs.
+#
+# Protocol (loopback only): one JSON request line per connection, as for the hashing agent (agent.py).
+#   {"op": "compare", "local": l, "remote": r, "mode": m, "rtol": x, "atol": y}
+#       -> {"result": Result fields} / {"notice": text} as they happen, then {"done": true, "statuses", "seconds"}
+#   {"op": "status"}  -> {"job", "local", "remote", "results", "seconds"} per running job
+#   {"op": "cancel", "job": id}
+# Closing the connection cancels its job. Jobs run concurrently on the shared pools; each keeps at
+# most MAX_IN_FLIGHT / running jobs tasks submitted, so a large job cannot starve a small one.
+DAEMON_HOST = "127.0.0.1"
+
+def _dump(obj):
+    return (json.dumps(obj, separators=(",", ":")) + "\n").encode()
+
+def init_worker(flag, shared_devices):
+    # Process pool initializer: attach to the abort flag and device limits, import the deep comparison stack once.
+    # Ctrl-C reaches the whole process group; workers leave it to the daemon, which sets abort_flag.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    abort_flag.init_worker(flag)
+    devices.init_worker(shared_devices)
+    import H5Compare.comparator  # noqa: F401
+
+def _ready():
+    return os.getpid()
+
+class Job:
+    def __init__(self, job_id, local_root, remote_root, mode=COMPARE_MODE, rtol=RTOL, atol=ATOL):
+        self.id, self.local_root, self.remote_root = job_id, local_root, remote_root
+        self.mode, self.rtol, self.atol = mode, float(rtol), float(atol)
+        self.q = Queue()
+        self.cancelled = Event()
+        self.statuses = Counter()
+        self.started = time.perf_counter()
+
+    def info(self):
+        return {"job": self.id, "local": self.local_root, "remote": self.remote_root,
+                "results": sum(self.statuses.values()), "seconds": time.perf_counter() - self.started}
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            op = request.get("op")
+            if op == "compare":
+                self.compare(request)
+                return
+            if op == "status":
+                for job in list(self.server.jobs.values()):
+                    self.wfile.write(_dump(job.info()))
+            elif op == "cancel":
+                job = self.server.jobs.get(request["job"])
+                if job is None:
+                    raise KeyError(f"No running job {request['job']}")
+                job.cancelled.set()
+            else:
+                raise ValueError(f"Unknown op: {op}")
+            self.wfile.write(_dump({"done": True}))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            self.wfile.write(_dump({"error": str(e)}))
+
+    def compare(self, request):
+        job = self.server.start(request["local"], request["remote"], request.get("mode", COMPARE_MODE),
+                                request.get("rtol", RTOL), request.get("atol", ATOL))
+        try:
+            while True:
+                msg = job.q.get()
+                if isinstance(msg, str) and msg == "__DONE__":
+                    break
+                if isinstance(msg, Result):
+                    job.statuses[msg.status] += 1
+                    self.wfile.write(_dump({"result": asdict(msg)}))
+                else:
+                    self.wfile.write(_dump({"notice": str(msg)}))
+            self.wfile.write(_dump({"done": True, "job": job.id, "statuses": dict(job.statuses),
+                                    "seconds": time.perf_counter() - job.started}))
+        except OSError:
+            job.cancelled.set()  # <-- client went away; stop submitting its tasks
+        finally:
+            self.server.finish(job)
+
+class DaemonServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=DAEMON_PORT):
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        super().__init__((DAEMON_HOST, port), DaemonHandler)
+        self.jobs, self.lock, self.ids = {}, Lock(), count(1)
+        self.io_pool  = ThreadPoolExecutor(max_workers=IO_THREADS)
+        self.cpu_pool = ProcessPoolExecutor(max_workers=NUM_WORKERS, mp_context=devices.POOL_CONTEXT,
+                                            initializer=init_worker, initargs=(abort_flag.shared(), devices.shared()))
+        for future in [self.cpu_pool.submit(_ready) for _ in range(NUM_WORKERS)]:
+            future.result()  # <-- start every worker now rather than on the first job's deep stage
+
+    def share(self):
+        # Fair share of the pools, re-read on each submission as jobs come and go
+        return max(2, MAX_IN_FLIGHT // max(1, len(self.jobs)))
+
+    def start(self, local_root, remote_root, mode, rtol, atol):
+        with self.lock:
+            job = Job(next(self.ids), local_root, remote_root, mode, rtol, atol)
+            self.jobs[job.id] = job
+        Thread(target=self.run_job, args=(job,), daemon=True).start()
+        return job
+
+    def finish(self, job):
+        job.cancelled.set()
+        with self.lock:
+            self.jobs.pop(job.id, None)
+
+    def run_job(self, job):
+        # Same steps as main.run_comparison, on the shared pools
+        q = job.q
+        try:
+            # Inside the try: off the main thread (no serve()) main's signal.signal raises, and the
+            # client must still get its "__DONE__"
+            from H5Compare.main import collect_h5_files, open_remote, precheck, pair_files, compare_jobs
+            local_files = collect_h5_files(job.local_root)
+            remote_files, check_task_for, deep_task = open_remote(job.remote_root, mode=job.mode,
+                                                                  rtol=job.rtol, atol=job.atol)
+            error = precheck(local_files, remote_files)
+            if error:
+                q.put(error)
+                return
+            jobs = pair_files(local_files, remote_files, q)
+            compare_jobs(jobs, q, self.io_pool, self.cpu_pool, check_task_for(jobs), deep_task,
+                         max_in_flight=self.share, cancelled=lambda: job.cancelled.is_set() or abort_flag.is_set())
+            if job.cancelled.is_set() or abort_flag.is_set():
+                q.put("[ABORTED] Comparison stopped by user")
+        except Exception as e:
+            q.put(f"[ERROR] Job {job.id} failed: {e}")
+        finally:
+            q.put("__DONE__")
+
+    def server_close(self):
+        super().server_close()
+        self.io_pool.shutdown(wait=False, cancel_futures=True)
+        self.cpu_pool.shutdown(wait=False, cancel_futures=True)
+
+def serve(port=DAEMON_PORT):
+    from H5Compare import main  # noqa: F401  <-- SIGINT / SIGTERM set abort_flag, checked below
+    with DaemonServer(port) as server:
+        Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Comparison daemon on {DAEMON_HOST}:{server.server_address[1]} with {NUM_WORKERS} warm workers",
+              flush=True)
+        while not abort_flag.is_set():
+            time.sleep(0.5)
+        server.shutdown()
+
+def request(op, port=DAEMON_PORT, **args):
+    # Yields the daemon's reply lines, the final {"done": ...} included
+    with socket.create_connection((DAEMON_HOST, port)) as sock, sock.makefile("rwb") as f:
+        f.write(_dump({"op": op, **args}))
+        f.flush()
+        for line in f:
+            reply = json.loads(line)
+            if "error" in reply:
+                raise RuntimeError(f"Daemon: {reply['error']}")
+            yield reply
+            if reply.get("done"):
+                return
+    raise ConnectionError("Daemon closed the connection")
+
+def _root(root):
+    # The daemon's working directory is not the client's
+    return root if "://" in root else os.path.abspath(root)
+
+def submit(local_root, remote_root, mode=COMPARE_MODE, rtol=RTOL, atol=ATOL, port=DAEMON_PORT):
+    # Client side of run_comparison: same report and results file, the work done by the daemon
+    local_root, remote_root = _root(local_root), _root(remote_root)
+    q = Queue()
+    with open(REPORT_FILE, "w", encoding="utf-8") as f:
+        f.write(f"HDF5 Comparison Report (daemon)\nGenerated: {datetime.now()}\n")
+        f.write("="*60 + "\n")
+    result_writer = open_result_writer(RESULTS_FILE, local_root, remote_root)
+    writer_thread = Thread(target=log_writer, args=(q, REPORT_FILE, result_writer), daemon=True)
+    writer_thread.start()
+    try:
+        for reply in request("compare", port, local=local_root, remote=remote_root, mode=mode, rtol=rtol, atol=atol):
+            if "result" in reply:
+                q.put(Result(**reply["result"]))
+            elif "notice" in reply:
+                q.put(reply["notice"])
+            else:
+                q.put(f"\nJob {reply['job']} finished in {reply['seconds']:.2f} s: "
+                      + (", ".join(f"{n} {status}" for status, n in sorted(reply["statuses"].items())) or "no files"))
+    except (OSError, RuntimeError) as e:
+        q.put(f"[ERROR] Comparison daemon on port {port}: {e}")
+    finally:
+        q.put("__DONE__")
+        writer_thread.join()
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if args[:1] == ["serve"]:
+        serve()
+    elif args[:1] == ["submit"] and len(args) == 3:
+        submit(args[1], args[2])
+    elif args[:1] == ["status"]:
+        for reply in request("status"):
+            if not reply.get("done"):
+                print(f"job {reply['job']}: {reply['results']} results in {reply['seconds']:.1f} s  "
+                      f"{reply['local']} <-> {reply['remote']}")
+    else:
+        print("Usage: python -m H5Compare.daemon serve | submit <local root> <remote root> [--direct] "
+              "[--rtol=..] [--atol=..] | status   [--daemon-port=8766]")
+        sys.exit(1)
@@ -0,0 +1,70 @@
+# H5Compare/devices.py
+import multiprocessing
+import time
+from H5Compare import abort_flag  # <-- a throttled reader still stops promptly
+from .config import LOCAL_IO_THREADS, REMOTE_IO_THREADS, LOCAL_MB_S, REMOTE_MB_S
+
+# Process pools are spawned, never forked: a fork while I/O threads hold SQLite or HDF5 locks
+# leaves the child waiting on a lock nobody will release. The shared objects below come from
+# the same context so they can be handed to those workers.
+POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+class Device:
+    # One storage root: at most `readers` concurrent reads and, with mb_s, a token bucket over the bytes
+    # read. Slots, bucket and byte counter live in shared memory and are handed to the process pool,
+    # so the limits hold for the I/O threads and every deep comparison worker together.
+    #   with DEVICES[side]:  ...read...        one read slot
+    #   DEVICES[side].take(nbytes)             count the bytes; sleeps while over the cap
+    def __init__(self, name, readers, mb_s=0):
+        self.name, self.readers, self.mb_s = name, readers, mb_s
+        self.slots = POOL_CONTEXT.BoundedSemaphore(readers)
+        self.lock = POOL_CONTEXT.Lock()
+        self.bucket = POOL_CONTEXT.RawArray("d", [mb_s * 1e6, time.monotonic()])  # tokens (bytes), last refill
+        self.read = POOL_CONTEXT.RawValue("q", 0)  # bytes read, all stages
+
+    def __enter__(self):
+        self.slots.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.slots.release()
+
+    def take(self, nbytes):
+        with self.lock:
+            self.read.value += nbytes
+            if not self.mb_s:
+                return
+            rate = self.mb_s * 1e6
+            now = time.monotonic()
+            tokens = min(rate, self.bucket[0] + (now - self.bucket[1]) * rate)  # <-- at most one second of burst
+            self.bucket[0], self.bucket[1] = tokens - nbytes, now  # <-- may go negative: later readers wait longer
+        deadline = now + max(0.0, nbytes - tokens) / rate
+        while not abort_flag.is_set() and time.monotonic() < deadline:
+            time.sleep(max(0.0, min(0.2, deadline - time.monotonic())))
+
+DEVICES = {"local": Device("local", LOCAL_IO_THREADS, LOCAL_MB_S),
+           "remote": Device("remote", REMOTE_IO_THREADS, REMOTE_MB_S)}
+
+def read_slab(dset, sel, side):
+    # dset[sel] under a read slot of side, counted against its cap
+    device = DEVICES[side]
+    with device:
+        data = dset[sel]
+    device.take(data.nbytes)
+    return data
+
+def shared():
+    return DEVICES
+
+def init_worker(devices):
+    # ProcessPoolExecutor initializer (with abort_flag.init_worker): use the parent's slots and buckets
+    DEVICES.update(devices)
+
+def bytes_read():
+    return {name: device.read.value for name, device in DEVICES.items()}
+
+def usage(before):
+    # Per-device figures for metrics.RunMetrics since a bytes_read() snapshot. Deep comparison reads
+    # count the dataset bytes h5py returns, which for compressed data is more than was on disk.
+    return {name: {"bytes": device.read.value - before.get(name, 0), "readers": device.readers,
+                   "cap_mb_s": device.mb_s} for name, device in DEVICES.items()}
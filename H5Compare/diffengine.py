@@ -0,0 +1,177 @@
+# H5Compare/diffengine.py
+from collections import namedtuple
+import h5py
+import numpy as np
+from H5Compare import abort_flag  # <-- checked once per block
+from .config import RTOL, ATOL, MEMORY_BUDGET_MB
+from .utils import block_shape, iter_blocks, raw_chunks_comparable, same_raw_chunk, structure
+from .devices import read_slab
+
+# One entry per difference found. kind is one of
+#   missing / extra  object only in the first / second file (a group's members are not listed)
+#   type             group in one file, dataset in the other
+#   shape / dtype    dataset shape or (byte-order normalised) dtype changed
+#   data             values outside RTOL/ATOL; stats has count, max_abs, max_rel, first_index
+#   attr             attribute missing, extra or with a different value; path is "object@name"
+Difference = namedtuple("Difference", "kind path detail stats")
+
+def render(diff):
+    return f"{diff.kind} {diff.path}: {diff.detail}" if diff.detail else f"{diff.kind} {diff.path}"
+
+class MismatchStats:
+    # Running statistics over the blocks of one dataset
+    def __init__(self):
+        self.count = 0
+        self.max_abs = 0.0
+        self.max_rel = 0.0
+        self.nan = 0
+        self.first_index = None
+
+    def add(self, a, b, start, rtol, atol):
+        numeric = a.dtype.kind in "iufc" and b.dtype.kind in "iufc"
+        if numeric:
+            a = a.astype(np.complex128 if "c" in (a.dtype.kind, b.dtype.kind) else np.float64, copy=False)
+            mismatch = ~np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True)
+        else:
+            mismatch = np.asarray(a != b)
+        n = int(np.count_nonzero(mismatch))
+        if not n:
+            return
+        self.count += n
+        first = np.unravel_index(int(np.argmax(mismatch)), mismatch.shape)
+        first = tuple(int(s + i) for s, i in zip(start, first))
+        if self.first_index is None or first < self.first_index:  # <-- blocks are not visited in C order
+            self.first_index = first
+        if numeric:
+            x, y = a[mismatch], b[mismatch]
+            err = np.abs(x - y)
+            self.nan += int(np.count_nonzero(np.isnan(err)))
+            err, scale = err[~np.isnan(err)], np.maximum(np.abs(x), np.abs(y))[~np.isnan(err)]
+            if err.size:
+                self.max_abs = max(self.max_abs, float(err.max()))
+                self.max_rel = max(self.max_rel, float((err / scale).max()))  # <-- scale > 0 where values differ
+
+    def merge(self, other):
+        # Combine the statistics of two parts of the same dataset
+        self.count += other.count
+        self.max_abs, self.max_rel = max(self.max_abs, other.max_abs), max(self.max_rel, other.max_rel)
+        self.nan += other.nan
+        if other.first_index is not None and (self.first_index is None or other.first_index < self.first_index):
+            self.first_index = other.first_index
+        return self
+
+    def as_dict(self, size):
+        return {"count": self.count, "size": size, "max_abs": self.max_abs, "max_rel": self.max_rel,
+                "nan_mismatches": self.nan, "first_index": list(self.first_index)}
+
+    def describe(self, size):
+        text = f"{self.count} of {size} elements differ"
+        if self.max_abs or self.max_rel:
+            text += f", max abs {self.max_abs:.3g}, max rel {self.max_rel:.3g}"
+        if self.nan:
+            text += f", {self.nan} NaN vs number"
+        return text + f", first at [{', '.join(map(str, self.first_index))}]"
+
+def diff_attrs(n1, n2, path):
+    diffs = []
+    attrs1, attrs2 = dict(n1.attrs), dict(n2.attrs)
+    for key in sorted(attrs1.keys() | attrs2.keys()):
+        where = f"{path}@{key}"
+        if key not in attrs2:
+            diffs.append(Difference("attr", where, "missing in second file", None))
+        elif key not in attrs1:
+            diffs.append(Difference("attr", where, "extra in second file", None))
+        elif attrs1[key] != attrs2[key]:
+            diffs.append(Difference("attr", where, f"{attrs1[key]} vs {attrs2[key]}"[:200], None))
+    return diffs
+
+def diff_structure(nodes1, nodes2):
+    # Differences visible in the headers (utils.structure); layout changes are not differences
+    diffs, gone = [], ()
+    for path in sorted(nodes1.keys() | nodes2.keys()):
+        if path.startswith(gone):
+            continue  # <-- inside a group already reported missing / extra
+        n1, n2 = nodes1.get(path), nodes2.get(path)
+        if n1 is None or n2 is None or n1.kind != n2.kind:
+            kind = "missing" if n2 is None else "extra" if n1 is None else "type"
+            diffs.append(Difference(kind, path, f"{n1.kind} vs {n2.kind}" if kind == "type" else "", None))
+            gone += (path + "/",)
+            continue
+        diffs.extend(diff_attrs(n1, n2, path))
+        if n1.dtype != n2.dtype:
+            diffs.append(Difference("dtype", path, f"{n1.dtype} vs {n2.dtype}", None))
+        if n1.shape != n2.shape:
+            diffs.append(Difference("shape", path, f"{n1.shape} vs {n2.shape}", None))
+    return diffs
+
+def dataset_stats(d1, d2, rtol=RTOL, atol=ATOL, budget_mb=MEMORY_BUDGET_MB, region=None):
+    # Mismatch statistics over the whole dataset, or over region ((start, stop) per axis,
+    # aligned to the chunk grid as plan_parts makes them)
+    stats = MismatchStats()
+    if d1.ndim == 0:
+        stats.add(np.asarray(read_slab(d1, (), "local")), np.asarray(read_slab(d2, (), "remote")), (), rtol, atol)
+        return stats
+
+    region = region or tuple((0, n) for n in d1.shape)
+    shape = tuple(stop - start for start, stop in region)
+    raw = raw_chunks_comparable(d1, d2)
+    # Two blocks, a float64 copy and the isclose temporaries must fit in the budget
+    itemsize = max(d1.dtype.itemsize, d2.dtype.itemsize, 8)
+    block = d1.chunks if raw else block_shape(shape, itemsize, d1.chunks, budget_mb * 1024 * 1024 // 8)
+    for sel in iter_blocks(shape, block):
+        abort_flag.check()
+        sel = tuple(slice(s.start + r[0], s.stop + r[0]) for s, r in zip(sel, region))
+        start = tuple(s.start for s in sel)
+        if raw and same_raw_chunk(d1, d2, start):
+            continue
+        stats.add(read_slab(d1, sel, "local"), read_slab(d2, sel, "remote"), start, rtol, atol)  # <-- d1 local, d2 remote
+    return stats
+
+def data_difference(path, stats, size):
+    return [Difference("data", path, stats.describe(size), stats.as_dict(size))] if stats.count else []
+
+def diff_dataset(d1, d2, path, rtol=RTOL, atol=ATOL, budget_mb=MEMORY_BUDGET_MB):
+    # Values only; shape and dtype were checked from the headers
+    if d1.shape is None:
+        return []
+    return data_difference(path, dataset_stats(d1, d2, rtol, atol, budget_mb), d1.size)
+
+def plan_parts(file1, file2, part_bytes):
+    # Headers only: (structural differences, []) or ([], [(dataset, region), ...]) with regions
+    # of about part_bytes on the chunk grid, for spreading one file over several workers
+    with h5py.File(file1, "r") as f1, h5py.File(file2, "r") as f2:
+        nodes1 = structure(f1)
+        diffs = diff_structure(nodes1, structure(f2))
+        if diffs:
+            return diffs, []
+        parts = []
+        for path in sorted(nodes1):
+            if nodes1[path].kind != "dataset" or f1[path].shape is None:
+                continue
+            d = f1[path]
+            if d.ndim == 0:
+                parts.append((path, None))
+                continue
+            block = block_shape(d.shape, d.dtype.itemsize, d.chunks, part_bytes)
+            parts += [(path, tuple((s.start, s.stop) for s in sel)) for sel in iter_blocks(d.shape, block)]
+    return [], parts
+
+def diff_region(file1, file2, path, region, rtol=RTOL, atol=ATOL, budget_mb=MEMORY_BUDGET_MB):
+    # One part from plan_parts: (MismatchStats, dataset size)
+    with h5py.File(file1, "r") as f1, h5py.File(file2, "r") as f2:
+        d1, d2 = f1[path], f2[path]
+        return dataset_stats(d1, d2, rtol, atol, budget_mb, region), d1.size
+
+def diff_h5(file1, file2, rtol=RTOL, atol=ATOL, budget_mb=MEMORY_BUDGET_MB, datasets=None):
+    # Every difference between two files, in-process (no h5diff per file). Structural differences
+    # are found from the headers alone and, if there are any, no dataset payload is read at all.
+    # datasets limits the payload comparison, e.g. to those whose content digests differ.
+    with h5py.File(file1, "r") as f1, h5py.File(file2, "r") as f2:
+        nodes1 = structure(f1)
+        diffs = diff_structure(nodes1, structure(f2))
+        if diffs:
+            return diffs
+        for path in sorted(nodes1):
+            if nodes1[path].kind == "dataset" and (datasets is None or path in datasets):
+                diffs.extend(diff_dataset(f1[path], f2[path], path, rtol, atol, budget_mb))
+    return diffs
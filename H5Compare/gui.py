@@ -1,5 +1,6 @@
 # H5Compare/gui.py
 import sys, os
+from collections import deque
 from PyQt5 import QtWidgets, QtCore, QtGui
 
 # Ensure parent folder is in sys.path so absolute imports work
@@ -7,8 +8,96 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 
 from H5Compare import abort_flag  # <-- shared abort flag
 from H5Compare.main import run_comparison  # <-- run_comparison in same process
+from H5Compare.results import Result, OK, DIFFERENT, DIFFERENT_SIZE, MISSING_REMOTE, MISSING_LOCAL, ERROR
+
+STATUS_COLORS = {
+    OK: "#00ff00",
+    DIFFERENT: "#ffff00",
+    DIFFERENT_SIZE: "#ff5555",
+    MISSING_REMOTE: "#ff5555",
+    MISSING_LOCAL: "#ff5555",
+    ERROR: "#ff0000",
+}
+
+STATUS_FILTERS = {
+    "All": None,
+    "Problems only": {DIFFERENT, DIFFERENT_SIZE, MISSING_REMOTE, MISSING_LOCAL, ERROR},
+    "OK": {OK},
+    "Different": {DIFFERENT, DIFFERENT_SIZE},
+    "Missing": {MISSING_REMOTE, MISSING_LOCAL},
+    "Errors": {ERROR},
+}
+
+def notice_color(msg):
+    # Colour for plain notice strings (not per-file results)
+    if "Comparison finished" in msg:
+        return "#00ff00"
+    elif "mismatch" in msg.lower() or "abort" in msg.lower():
+        return "#ff0000"
+    return "#ffffff"
+
+class ResultModel(QtCore.QAbstractListModel):
+    # Rows are Result records or (notice, colour) tuples; only visible rows are ever rendered
+    StatusRole = QtCore.Qt.UserRole + 1
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        row = self.rows[index.row()]
+        if isinstance(row, Result):
+            if role == QtCore.Qt.DisplayRole:
+                return str(row).replace("\n", "  |  ")  # <-- one line per row keeps item heights uniform
+            if role == QtCore.Qt.ToolTipRole:
+                return str(row)
+            if role == QtCore.Qt.ForegroundRole:
+                return QtGui.QColor(STATUS_COLORS.get(row.status, "#ffffff"))
+            if role == self.StatusRole:
+                return row.status
+        else:
+            text, color = row
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.ToolTipRole):
+                return text
+            if role == QtCore.Qt.ForegroundRole:
+                return QtGui.QColor(color)
+            if role == self.StatusRole:
+                return None
+        return None
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.endResetModel()
+
+class StatusFilterModel(QtCore.QSortFilterProxyModel):
+    # Notices are always shown; result rows only if their status is in the selected set
+    def __init__(self):
+        super().__init__()
+        self.statuses = None
+
+    def set_statuses(self, statuses):
+        self.statuses = statuses
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.statuses is None:
+            return True
+        status = self.sourceModel().rows[source_row]
+        return not isinstance(status, Result) or status.status in self.statuses
 
 class HDF5ComparerGUI(QtWidgets.QMainWindow):
+    REFRESH_MS = 250  # UI updates per second are bounded by this, not by the result rate
 
     def __init__(self):
         super().__init__()
@@ -21,7 +110,7 @@ class HDF5ComparerGUI(QtWidgets.QMainWindow):
     def dark_style(self):
         return """
         QWidget { background-color: #121212; color: #ffffff; font-size: 14px; }
-        QLineEdit, QTextEdit { background-color: #1e1e1e; border: 2px solid #333; border-radius: 8px; padding: 4px; color: #ffffff; }
+        QLineEdit, QListView { background-color: #1e1e1e; border: 2px solid #333; border-radius: 8px; padding: 4px; color: #ffffff; }
         QPushButton { background-color: #3a3a3a; border-radius: 8px; padding: 6px; }
         QPushButton:hover { background-color: #505050; }
         QPushButton:disabled { background-color: #2a2a2a; color: #777777; }
@@ -65,10 +154,30 @@ class HDF5ComparerGUI(QtWidgets.QMainWindow):
         self.progress.setTextVisible(True)
         layout.addWidget(self.progress)
 
-        self.log_window = QtWidgets.QTextEdit()
-        self.log_window.setReadOnly(True)
+        self.filter_box = QtWidgets.QComboBox()
+        self.filter_box.addItems(STATUS_FILTERS.keys())
+        self.filter_box.currentTextChanged.connect(
+            lambda name: self.filter_model.set_statuses(STATUS_FILTERS[name]))
+        filter_row = QtWidgets.QHBoxLayout()
+        filter_row.addWidget(QtWidgets.QLabel("Show:"))
+        filter_row.addWidget(self.filter_box)
+        filter_row.addStretch()
+        layout.addLayout(filter_row)
+
+        self.model = ResultModel()
+        self.filter_model = StatusFilterModel()
+        self.filter_model.setSourceModel(self.model)
+        self.log_window = QtWidgets.QListView()
+        self.log_window.setModel(self.filter_model)
+        self.log_window.setUniformItemSizes(True)  # <-- constant-time layout for huge row counts
+        self.log_window.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
         layout.addWidget(self.log_window)
 
+        # Results are coalesced on the comparison thread and pulled in here a few times per second
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.setInterval(self.REFRESH_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
     def browse_local(self):
         folder = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Local Folder")
         if folder:
@@ -87,16 +196,16 @@ class HDF5ComparerGUI(QtWidgets.QMainWindow):
                 self.log("Please select both root folders.", "red")
                 return
 
+            self.model.clear()
             self.progress.setValue(0)
             self.progress.setFormat("0/0")
             self.aborted = False
 
             # Start backend thread (run in same memory space)
             self.thread = ComparisonThread(local_root, remote_root)
-            self.thread.log_signal.connect(self.handle_log)
-            self.thread.progress_signal.connect(self.handle_progress)  # <-- connect progress
             self.thread.finished_signal.connect(self.comparison_finished)
             self.thread.start()
+            self.refresh_timer.start()
 
             self.start_btn.setText("Stop Comparison")
             self.start_btn.setStyleSheet("background-color:#aa3333; color:white;")
@@ -107,25 +216,20 @@ class HDF5ComparerGUI(QtWidgets.QMainWindow):
                 self.log("Stopping comparison...", "#ffff00")
                 self.start_btn.setEnabled(False)
 
-    def handle_log(self, msg):
-        if "[OK]" in msg:
-            color = "#00ff00"
-        elif "[DIFFERENT]" in msg:
-            color = "#ffff00"
-        elif "[MISSING" in msg or "[DIFFERENT SIZE]" in msg:
-            color = "#ff5555"
-        elif "Comparison finished" in msg:
-            color = "#00ff00"
-        elif "mismatch" in msg.lower() or "aborting" in msg.lower():
-            color = "#ff0000"
-        else:
-            color = "#ffffff"
-
-        self.log_window.setTextColor(QtGui.QColor(color))
-        self.log_window.append(msg)
-        self.log_window.verticalScrollBar().setValue(
-            self.log_window.verticalScrollBar().maximum()
-        )
+    def refresh(self):
+        # Drain everything the comparison thread produced since the last tick in one model update
+        rows = []
+        pending = self.thread.pending
+        while pending:
+            item = pending.popleft()
+            rows.append(item if isinstance(item, Result) else (item, notice_color(item)))
+        if rows:
+            scrollbar = self.log_window.verticalScrollBar()
+            at_bottom = scrollbar.value() == scrollbar.maximum()
+            self.model.append_rows(rows)
+            if at_bottom:
+                self.log_window.scrollToBottom()
+        self.handle_progress(self.thread.completed_files, self.thread.total_files)
 
     def handle_progress(self, completed, total):
         if total > 0:
@@ -137,6 +241,8 @@ class HDF5ComparerGUI(QtWidgets.QMainWindow):
             self.progress.setFormat("[0/0] 0%")
 
     def comparison_finished(self):
+        self.refresh_timer.stop()
+        self.refresh()
         self.start_btn.setEnabled(True)
         self.start_btn.setStyleSheet("background-color:#008000; color:white;")
         self.start_btn.setText("Start Comparison")
@@ -146,15 +252,10 @@ class HDF5ComparerGUI(QtWidgets.QMainWindow):
             self.progress.setValue(100)
 
     def log(self, msg, color="#ffffff"):
-        self.log_window.setTextColor(QtGui.QColor(color))
-        self.log_window.append(msg)
-        self.log_window.verticalScrollBar().setValue(
-            self.log_window.verticalScrollBar().maximum()
-        )
+        self.model.append_rows([(msg, color)])
+        self.log_window.scrollToBottom()
 
 class ComparisonThread(QtCore.QThread):
-    log_signal = QtCore.pyqtSignal(str)
-    progress_signal = QtCore.pyqtSignal(int, int)  # <-- emit completed files
     finished_signal = QtCore.pyqtSignal()
 
     def __init__(self, local_root, remote_root):
@@ -163,12 +264,13 @@ class ComparisonThread(QtCore.QThread):
         self.remote_root = remote_root
         self.completed_files = 0
         self.total_files = 0
+        self.pending = deque()  # <-- results waiting for the GUI timer; deque append/popleft are thread-safe
 
     def abort(self):
-        abort_flag.ABORT = True
+        abort_flag.set()
 
     def run(self):
-        abort_flag.ABORT = False
+        abort_flag.clear()
 
         # Pre-count total files for progress
         import H5Compare.utils as utils
@@ -182,18 +284,15 @@ class ComparisonThread(QtCore.QThread):
         class SignalQueue(original_queue_class):
             def put(self_inner, item):
                 super().put(item)
-                line = str(item).strip()
-                if line:
-                    self_inner.thread.log_signal.emit(line)
-                    # Increment progress only for actual comparison results
-                    if any(tag in line for tag in ["[OK]", "[DIFFERENT]", "[MISSING", "[DIFFERENT SIZE]"]):
-                        self_inner.thread.completed_files += 1
-                        self_inner.thread.progress_signal.emit(
-                            self_inner.thread.completed_files, self_inner.thread.total_files
-                        )
+                if isinstance(item, str) and (item == "__DONE__" or not item.strip()):
+                    return
+                self_inner.thread.pending.append(item)
+                # Increment progress only for per-file result records
+                if isinstance(item, Result):
+                    self_inner.thread.completed_files += 1
 
         main_module.Queue = SignalQueue
-        main_module.Queue.thread = self  # give access to log_signal
+        main_module.Queue.thread = self  # give access to the pending deque
 
         try:
             run_comparison(self.local_root, self.remote_root)
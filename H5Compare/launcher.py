@@ -1,3 +1,8 @@
 # H5Compare/launcher.py
+import multiprocessing
 import runpy
-runpy.run_module('H5Compare.gui', run_name='__main__')
+
+# Spawned pool workers re-run this script as __mp_main__: only the real entry point starts the GUI
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # <-- frozen exe: a spawned worker runs its task here and exits
+    runpy.run_module('H5Compare.gui', run_name='__main__')
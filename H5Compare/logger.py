@@ -1,12 +1,44 @@
 # H5Compare/logger.py
-from queue import Queue
+import sys
+from queue import Queue, Empty
+from .results import Result
 
-def log_writer(queue: Queue, report_file: str):
+def log_writer(queue: Queue, report_file: str, result_writer=None, batch_size=1000, metrics=None, journal=None):
+    # Queue items are Result records or plain notice strings. Whatever has queued up is
+    # written as one batch: one console write, one report write, one structured insert.
+    # metrics (metrics.RunMetrics) aggregates timings here, off the worker threads;
+    # journal (results.CheckpointJournal) records finished files once the report has them.
     with open(report_file, "a", encoding="utf-8") as f:
-        while True:
-            msg = queue.get()
-            if msg == "__DONE__":
-                break
-            print(msg, flush=True)
-            f.write(msg + "\n")
-            queue.task_done()
+        done = False
+        while not done:
+            batch = [queue.get()]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(queue.get_nowait())
+                except Empty:
+                    break
+            for i, msg in enumerate(batch):
+                if isinstance(msg, str) and msg == "__DONE__":
+                    batch, done = batch[:i], True
+                    break
+
+            if batch:
+                text = "".join(f"{msg}\n" for msg in batch)
+                sys.stdout.write(text)
+                sys.stdout.flush()
+                f.write(text)
+                if result_writer is not None or metrics is not None or journal is not None:
+                    results = [msg for msg in batch if isinstance(msg, Result)]
+                    if result_writer is not None:
+                        result_writer.write(results)
+                    if metrics is not None:
+                        metrics.add(results)
+                    if journal is not None:
+                        f.flush()  # <-- a file is only journaled once its report line is on disk
+                        journal.write(results)
+            for _ in batch:
+                queue.task_done()
+    if result_writer is not None:
+        result_writer.close()
+    if journal is not None:
+        journal.close()
@@ -1,9 +1,11 @@
 # H5Compare/main.py
 import sys, os
 from datetime import datetime
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from queue import Queue
 from threading import Thread
+from functools import partial
+from contextlib import nullcontext
 import signal  # <-- for graceful abort
 
 # Ensure parent folder is in sys.path so absolute imports work
@@ -12,88 +14,228 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 from H5Compare import abort_flag  # <-- shared abort flag
 
 def handle_sigterm(signum, frame):
-    abort_flag.ABORT = True
+    abort_flag.set()
 
 signal.signal(signal.SIGTERM, handle_sigterm)
 signal.signal(signal.SIGINT, handle_sigterm)
 
-from H5Compare.config import LOCAL_ROOT, REMOTE_ROOT, NUM_WORKERS, REPORT_FILE, GUI_MODE, SIZE_TOL_MB
+from H5Compare.config import HASH_ALGO, COMPARE_MODE, RTOL, ATOL, LOCAL_ROOT, REMOTE_ROOT, NUM_WORKERS, IO_THREADS, MAX_IN_FLIGHT, REPORT_FILE, SAMPLE, SAMPLE_SEED, SAMPLE_RANGES, GUI_MODE, SIZE_TOL_MB, WATCH_MODE, RESULTS_FILE, METRICS, METRICS_FILE, CHECKPOINT_FILE, RESUME
 from H5Compare.utils import collect_h5_files
-from H5Compare.comparator import compare_file_task
+from H5Compare.comparator import check_file_task, check_sample_task, deep_compare_task, check_manifest_task, deep_manifest_task, check_agent_task, deep_agent_task, DeepJob, SplitJob
+from H5Compare.manifest import is_manifest, read_manifest
+from H5Compare.agent import is_agent, AgentClient, RemoteDigests
 from H5Compare.logger import log_writer
+from H5Compare.results import Result, MISSING_REMOTE, MISSING_LOCAL, open_result_writer, CheckpointJournal
+from H5Compare.scheduler import bounded_map, largest_first
+from H5Compare.metrics import RunMetrics
+from H5Compare import devices
+from H5Compare.sampling import Sample
+
+def init_worker(flag, shared_devices):
+    # Process pool initializer: workers attach to the parent's abort flag and device limits (needed with spawn)
+    abort_flag.init_worker(flag)
+    devices.init_worker(shared_devices)
+
+def process_pool(initializer=init_worker):
+    # Deep comparison workers; spawned (devices.POOL_CONTEXT) as the pool starts them lazily,
+    # when I/O threads are already running
+    return ProcessPoolExecutor(max_workers=NUM_WORKERS, mp_context=devices.POOL_CONTEXT, initializer=initializer,
+                               initargs=(abort_flag.shared(), devices.shared()))
+
+def pair_files(local_files, remote_files, q, rel_paths=None):
+    # Report files present on one side only; return (rel_path, rec_local, rec_remote) jobs for the rest
+    if rel_paths is None:
+        rel_paths = set(local_files.keys()) | set(remote_files.keys())
+
+    jobs = []
+    for rel_path in sorted(rel_paths):
+        f_local  = local_files.get(rel_path)
+        f_remote = remote_files.get(rel_path)
+
+        if not f_local and not f_remote:
+            continue  # <-- gone from both sides (watch mode)
+        if f_local and not f_remote:
+            q.put(Result(MISSING_REMOTE, rel_path))
+            continue
+        if f_remote and not f_local:
+            q.put(Result(MISSING_LOCAL, rel_path))
+            continue
+
+        jobs.append((rel_path, f_local, f_remote))
+    return jobs
+
+def compare_jobs(jobs, q, io_pool, cpu_pool, check_task=check_file_task, deep_task=deep_compare_task,
+                 max_in_flight=MAX_IN_FLIGHT, cancelled=abort_flag.is_set):
+    # Largest files first, bounded number of tasks in flight, results streamed as they finish.
+    # A large file's deep stage arrives as a SplitJob whose parts share the process pool.
+    # max_in_flight may be a callable, re-read on every submission (the daemon's fair share);
+    # cancelled stops this comparison only (the daemon cancels one job, abort_flag stops everything).
+    limit = max_in_flight if callable(max_in_flight) else lambda: max_in_flight
+    deep = {}  # future -> SplitJob it is a part of, or None
+
+    def finish(future):
+        owner = deep.pop(future)
+        if owner is None:
+            q.put(future.result())
+        elif owner.add(future.result()):
+            q.put(owner.result())
+
+    def submit(fn, *args, owner=None):
+        while len(deep) >= limit():
+            done, _ = wait(deep, return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(future)
+        deep[cpu_pool.submit(fn, *args)] = owner
+
+    try:
+        for result in bounded_map(io_pool, check_task, largest_first(jobs), limit):
+            if cancelled():
+                return
+            if isinstance(result, DeepJob):
+                submit(deep_task, *result)
+            elif isinstance(result, SplitJob):
+                for fn, *args in result.tasks():
+                    submit(fn, *args, owner=result)
+            else:
+                q.put(result)
+
+        for future in as_completed(list(deep)):
+            if cancelled():
+                return
+            finish(future)
+    finally:
+        for future in deep:
+            future.cancel()  # <-- only left over when cancelled; running parts finish on their own
+
+def open_remote(remote_root, phase=lambda name: nullcontext(), mode=COMPARE_MODE, rtol=RTOL, atol=ATOL,
+                sample_seed=None):
+    # (remote records, check task for the paired jobs, deep task) for a folder, manifest or hashing agent.
+    # An unreachable agent raises OSError / RuntimeError. With sample_seed, folder files are spot-checked.
+    if is_manifest(remote_root):
+        # Compare against a manifest written on the NAS host; no remote bytes are read
+        with phase("read_manifest"):
+            header, remote_files = read_manifest(remote_root)
+        check_task = partial(check_manifest_task, algo=header["algo"])
+        return remote_files, lambda jobs: check_task, partial(deep_manifest_task, algo=header["algo"])
+    if is_agent(remote_root):
+        # A hashing agent on the NAS host lists and hashes the remote tree; only digests cross the network
+        client = AgentClient(remote_root)
+        with phase("agent_list"):
+            remote_files = client.records()
+
+        def agent_check_task(jobs):
+            # One request for every remote digest; the agent hashes while the local side is read here
+            remote = RemoteDigests(client, [entry.path for _, rec, entry in jobs if rec.size == entry.size])
+            return partial(check_agent_task, algo=HASH_ALGO, remote=remote)
+        return remote_files, agent_check_task, partial(deep_agent_task, algo=HASH_ALGO, url=remote_root)
+    with phase("walk_remote"):
+        remote_files = collect_h5_files(remote_root)
+    if sample_seed is not None:
+        check_task = partial(check_sample_task, seed=sample_seed, rtol=rtol, atol=atol)
+    else:
+        check_task = partial(check_file_task, mode=mode, rtol=rtol, atol=atol)
+    return remote_files, lambda jobs: check_task, partial(deep_compare_task, rtol=rtol, atol=atol)
+
+def precheck(local_files, remote_files):
+    # Global count and total size check; the error line, or None to go ahead
+    local_count, remote_count = len(local_files), len(remote_files)
+    local_size  = sum(r.size for r in local_files.values())
+    remote_size = sum(r.size for r in remote_files.values())
+    size_diff_mb = abs(local_size - remote_size) / (1024 * 1024)
+
+    if local_count != remote_count:
+        return f"[ERROR] File count mismatch: Local={local_count}, Remote={remote_count}"
+    if size_diff_mb > SIZE_TOL_MB:
+        return (f"[ERROR] Total size mismatch: Local={local_size/1e6:.2f} MB, "
+                f"Remote={remote_size/1e6:.2f} MB (Δ={size_diff_mb:.2f} MB, "
+                f"tolerance={SIZE_TOL_MB} MB)")
+    return None
 
 def run_comparison(local_root=LOCAL_ROOT, remote_root=REMOTE_ROOT):
     q = Queue()
-    with open(REPORT_FILE, "w", encoding="utf-8") as f:
-        f.write(f"HDF5 Comparison Report (Parallelized)\nGenerated: {datetime.now()}\n")
+    # Spot checks verify too little of a file to count as verified on resume
+    journal = CheckpointJournal(CHECKPOINT_FILE, local_root, remote_root, RESUME) if CHECKPOINT_FILE and not SAMPLE else None
+    with open(REPORT_FILE, "a" if journal and journal.resumed else "w", encoding="utf-8") as f:
+        if journal and journal.resumed:
+            f.write("\n" + "="*60 + f"\nResumed: {datetime.now()}\n")
+        else:
+            f.write(f"HDF5 Comparison Report (Parallelized)\nGenerated: {datetime.now()}\n")
         f.write("="*60 + "\n")
 
-    writer_thread = Thread(target=log_writer, args=(q, REPORT_FILE), daemon=True)
-    writer_thread.start()
-
-    local_files  = collect_h5_files(local_root)
-    remote_files = collect_h5_files(remote_root)
+    metrics = RunMetrics() if METRICS or SAMPLE else None  # <-- the spot check bound needs the status counts
+    phase = metrics.phase if metrics else lambda name: nullcontext()  # <-- no timing work when disabled
 
-    # --- Global pre-check: count and size ---
-    local_count, remote_count = len(local_files), len(remote_files)
-    local_size  = sum(os.path.getsize(p) for p in local_files.values())
-    remote_size = sum(os.path.getsize(p) for p in remote_files.values())
-    size_diff_mb = abs(local_size - remote_size) / (1024 * 1024)
+    result_writer = open_result_writer(RESULTS_FILE, local_root, remote_root)
+    writer_thread = Thread(target=log_writer, args=(q, REPORT_FILE, result_writer),
+                           kwargs={"metrics": metrics, "journal": journal}, daemon=True)
+    writer_thread.start()
 
-    if local_count != remote_count:
-        q.put(f"[ERROR] File count mismatch: Local={local_count}, Remote={remote_count}")
+    # Walk times include the stat of every file (scandir entries)
+    with phase("walk_local"):
+        local_files = collect_h5_files(local_root)
+    try:
+        remote_files, check_task_for, deep_task = open_remote(remote_root, phase,
+                                                              sample_seed=SAMPLE_SEED if SAMPLE else None)
+    except (OSError, RuntimeError) as e:
+        if not is_agent(remote_root):
+            raise
+        q.put(f"[ERROR] Hashing agent {remote_root} unreachable: {e}")
         q.put("__DONE__")
         writer_thread.join()
         return
 
-    if size_diff_mb > SIZE_TOL_MB:
-        q.put(f"[ERROR] Total size mismatch: Local={local_size/1e6:.2f} MB, "
-              f"Remote={remote_size/1e6:.2f} MB (Δ={size_diff_mb:.2f} MB, "
-              f"tolerance={SIZE_TOL_MB} MB)")
+    error = precheck(local_files, remote_files)
+    if error:
+        q.put(error)
         q.put("__DONE__")
         writer_thread.join()
         return
-    # --- End pre-check ---
-
-    all_rel_paths = set(local_files.keys()) | set(remote_files.keys())
 
-    executor = ProcessPoolExecutor(max_workers=NUM_WORKERS)
+    rel_paths = journal.pending(local_files, remote_files) if journal else None
+    if journal and journal.resumed:
+        q.put(f"[RESUME] {len(local_files.keys() | remote_files.keys()) - len(rel_paths)} file(s) already verified "
+              f"in {CHECKPOINT_FILE}, {len(rel_paths)} to compare")
+    elif journal and RESUME:
+        q.put(f"[RESUME] No checkpoint for these roots in {CHECKPOINT_FILE}; comparing everything")
+    jobs = pair_files(local_files, remote_files, q, rel_paths)
+    sample = None
+    if SAMPLE:
+        # Manifest and agent digests cover whole files, so only the choice of files is sampled there
+        ranges = 0 if is_manifest(remote_root) or is_agent(remote_root) else SAMPLE_RANGES
+        sample = Sample(jobs, SAMPLE, SAMPLE_SEED, ranges)
+        jobs = sample.jobs
+        metrics.uniform = sample.uniform
+        q.put(sample.describe())
+    check_task = check_task_for(jobs)
+
+    # Size checks and hashing on I/O threads; only files needing a deep comparison go to processes
+    io_pool  = ThreadPoolExecutor(max_workers=IO_THREADS)
+    cpu_pool = process_pool()  # <-- workers only start on first deep job
+    before = devices.bytes_read()
     try:
-        tasks = []
-        for rel_path in sorted(all_rel_paths):
-            if abort_flag.ABORT:
-                q.put("[ABORTED] Comparison stopped by user")
-                break
-
-            f_local  = local_files.get(rel_path)
-            f_remote = remote_files.get(rel_path)
-
-            if f_local and not f_remote:
-                q.put(f"[MISSING on Remote] {rel_path}")
-                continue
-            if f_remote and not f_local:
-                q.put(f"[MISSING on LOCAL] {rel_path}")
-                continue
-
-            tasks.append(executor.submit(compare_file_task, rel_path, f_local, f_remote))
-
-        # Only iterate completed tasks if not aborted
-        if not abort_flag.ABORT:
-            for future in as_completed(tasks):
-                if abort_flag.ABORT:
-                    q.put("[ABORTED] Comparison stopped by user")
-                    break
-                q.put(future.result())
-
+        with phase("compare"):
+            compare_jobs(jobs, q, io_pool, cpu_pool, check_task, deep_task)
+        if abort_flag.is_set():
+            q.put("[ABORTED] Comparison stopped by user")
     finally:
-        # Shutdown executor immediately if abort requested
-        executor.shutdown(wait=False, cancel_futures=True)
-
+        # Shutdown executors immediately if abort requested
+        io_pool.shutdown(wait=False, cancel_futures=True)
+        cpu_pool.shutdown(wait=False, cancel_futures=True)
+
+    if metrics:
+        metrics.devices = devices.usage(before)
+        q.join()  # <-- every result has reached the aggregator
+        if sample:
+            q.put(sample.summary(metrics.statuses, metrics.uniform_statuses))
+        if METRICS:
+            q.put(metrics.summary())
+        if METRICS_FILE:
+            metrics.write(METRICS_FILE)
     q.put("__DONE__")
     writer_thread.join()
 
     # --- Unified final message ---
-    if not abort_flag.ABORT:
+    if not abort_flag.is_set():
         final_msg = f"\nComparison finished. Full report saved to: {REPORT_FILE}"
         if GUI_MODE:
             q.put(final_msg)
@@ -101,4 +243,8 @@ def run_comparison(local_root=LOCAL_ROOT, remote_root=REMOTE_ROOT):
             print(final_msg, flush=True)
 
 if __name__ == "__main__":
-    run_comparison()
+    if WATCH_MODE:
+        from H5Compare.watch import watch
+        watch()
+    else:
+        run_comparison()
@@ -0,0 +1,132 @@
+# H5Compare/manifest.py
+import gzip
+import json
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .config import HASH_ALGO, LOCAL_IO_THREADS, MAX_IN_FLIGHT
+from .utils import collect_h5_files, compare_digests
+from .cache import cached_file_hash, cached_h5_digests
+from .scheduler import bounded_map, largest_first
+from .results import Result, OK, DIFFERENT, DIFFERENT_SIZE, MISSING_REMOTE, MISSING_LOCAL
+
+# One JSON object per line: a header, then one entry per file. Paths always use "/" so
+# manifests written on the NAS host compare against a Windows workstation tree.
+MANIFEST_VERSION = 1
+
+ManifestRecord = namedtuple("ManifestRecord", "path size mtime_ns inode digest datasets")
+
+def is_manifest(path):
+    return os.path.isfile(path) and path.endswith((".jsonl", ".jsonl.gz"))
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def _dump(obj):
+    return json.dumps(obj, separators=(",", ":")) + "\n"
+
+def write_manifest(root, out_path, algo=HASH_ALGO, with_datasets=False):
+    def entry(rel_path, record):
+        digest, _ = cached_file_hash(record, "local", algo, split=False)
+        datasets = cached_h5_digests(record.path, "local", algo) if with_datasets else None
+        return rel_path, record, digest, datasets
+
+    files = collect_h5_files(root)
+    jobs = largest_first(files.items(), cost=lambda job: job[1].size)
+    with _open(out_path, "w") as f, ThreadPoolExecutor(max_workers=LOCAL_IO_THREADS) as pool:
+        f.write(_dump({"manifest": MANIFEST_VERSION, "algo": algo, "root": os.path.abspath(root),
+                       "created": datetime.now().isoformat(timespec="seconds")}))
+        # Entries are streamed out as they are hashed, so memory does not grow with the tree
+        for rel_path, record, digest, datasets in bounded_map(pool, entry, jobs, MAX_IN_FLIGHT):
+            line = {"path": rel_path.replace(os.sep, "/"), "size": record.size,
+                    "mtime_ns": record.mtime_ns, "digest": digest}
+            if datasets is not None:
+                line["datasets"] = datasets
+            f.write(_dump(line))
+    return len(files)
+
+def iter_manifest(path):
+    # Yields the header dict first, then one ManifestRecord per file
+    with _open(path, "r") as f:
+        header = json.loads(f.readline())
+        if header.get("manifest") != MANIFEST_VERSION:
+            raise ValueError(f"{path} is not an H5Compare manifest")
+        yield header
+        for line in f:
+            e = json.loads(line)
+            yield ManifestRecord(e["path"], e["size"], e["mtime_ns"], 0, e["digest"], e.get("datasets"))
+
+def read_manifest(path):
+    # (header, {rel_path (os.sep): ManifestRecord}) -- same shape as collect_h5_files
+    entries = iter_manifest(path)
+    header = next(entries)
+    return header, {e.path.replace("/", os.sep): e for e in entries}
+
+def merge_manifests(out_path, *in_paths):
+    # Union of entries; for a path present in several manifests the newest mtime wins
+    merged, algo = {}, None
+    for path in in_paths:
+        header, entries = read_manifest(path)
+        if algo and header["algo"] != algo:
+            raise ValueError(f"Cannot merge {header['algo']} manifest {path} into {algo} manifests")
+        algo = header["algo"]
+        for rel_path, e in entries.items():
+            if rel_path not in merged or e.mtime_ns > merged[rel_path].mtime_ns:
+                merged[rel_path] = e
+    with _open(out_path, "w") as f:
+        f.write(_dump({"manifest": MANIFEST_VERSION, "algo": algo, "root": None, "merged_from": list(in_paths),
+                       "created": datetime.now().isoformat(timespec="seconds")}))
+        for rel_path in sorted(merged):
+            e = merged[rel_path]
+            line = {"path": e.path, "size": e.size, "mtime_ns": e.mtime_ns, "digest": e.digest}
+            if e.datasets is not None:
+                line["datasets"] = e.datasets
+            f.write(_dump(line))
+    return len(merged)
+
+def diff_manifests(path1, path2):
+    # Results as run_comparison would report them, without touching either tree
+    header1, entries1 = read_manifest(path1)
+    header2, entries2 = read_manifest(path2)
+    if header1["algo"] != header2["algo"]:
+        raise ValueError(f"Hash algorithm mismatch: {header1['algo']} vs {header2['algo']}")
+    for rel_path in sorted(set(entries1) | set(entries2)):
+        e1, e2 = entries1.get(rel_path), entries2.get(rel_path)
+        if e1 and not e2:
+            yield Result(MISSING_REMOTE, rel_path)
+        elif e2 and not e1:
+            yield Result(MISSING_LOCAL, rel_path)
+        elif e1.size != e2.size:
+            yield Result(DIFFERENT_SIZE, rel_path)
+        elif e1.digest == e2.digest:
+            yield Result(OK, rel_path, "manifest hash match")
+        elif e1.datasets is not None and e2.datasets is not None:
+            diff_msg = compare_digests(e1.datasets, e2.datasets)
+            if diff_msg:
+                yield Result(DIFFERENT, rel_path, detail=diff_msg)
+            else:
+                yield Result(OK, rel_path, "manifest dataset digests match")
+        else:
+            yield Result(DIFFERENT, rel_path, detail="File digest differs (no dataset digests to compare)")
+
+if __name__ == "__main__":
+    usage = ("Usage: python -m H5Compare.manifest write <root> <out.jsonl[.gz]> [--datasets] [--hash-algo=...]\n"
+             "       python -m H5Compare.manifest merge <out.jsonl[.gz]> <in1> <in2> ...\n"
+             "       python -m H5Compare.manifest diff <a.jsonl[.gz]> <b.jsonl[.gz]>")
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) >= 3 and args[0] == "write":
+        n = write_manifest(args[1], args[2], with_datasets="--datasets" in sys.argv)
+        print(f"Wrote {n} entries to {args[2]}")
+    elif len(args) >= 4 and args[0] == "merge":
+        print(f"Wrote {merge_manifests(args[1], *args[2:])} entries to {args[1]}")
+    elif len(args) == 3 and args[0] == "diff":
+        for line in diff_manifests(args[1], args[2]):
+            print(line)
+    else:
+        print(usage)
+        sys.exit(1)
@@ -0,0 +1,113 @@
+# H5Compare/metrics.py
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+# Per-file phases come from Result.durations ("hash", "direct", "h5diff", "deep", ...).
+# io_local / io_remote are each side's share of the hash or direct phase; they overlap it,
+# so they are never added to the other phases. Run phases (walk_local, compare, ...) are timed once.
+SIDES = ("local", "remote")
+QUANTILES = (50, 90, 99)
+
+class RunMetrics:
+    def __init__(self):
+        self.run = {}                     # run phase -> seconds
+        self.phases = defaultdict(list)   # file phase -> seconds per file
+        self.side_bytes = Counter()
+        self.statuses = Counter()
+        self.uniform, self.uniform_statuses = set(), Counter()  # sampling.Sample.uniform and their statuses
+        self.devices = {}                 # devices.usage(): bytes read per device over the run, all stages
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.run[name] = self.run.get(name, 0.0) + time.perf_counter() - start
+
+    def add(self, results):
+        # Called by the log writer with each batch of Result records
+        for r in results:
+            self.statuses[r.status] += 1
+            if r.path in self.uniform:
+                self.uniform_statuses[r.status] += 1
+            for phase, seconds in r.durations.items():
+                self.phases[phase].append(seconds)
+            self.side_bytes.update(r.side_bytes)
+
+    def side_stats(self):
+        # Per-stream MB/s (bytes over time spent reading that side) and aggregate MB/s over the compare phase
+        wall = self.run.get("compare", 0.0)
+        stats = {}
+        for side in SIDES:
+            nbytes, seconds = self.side_bytes[side], sum(self.phases.get(f"io_{side}", ()))
+            stats[side] = {"bytes": nbytes, "seconds": seconds,
+                           "stream_mb_s": nbytes / 1e6 / seconds if seconds else 0.0,
+                           "aggregate_mb_s": nbytes / 1e6 / wall if wall else 0.0}
+        return stats
+
+    def device_stats(self):
+        # Achieved bandwidth per device over the compare phase, against its reader limit and MB/s cap
+        wall = self.run.get("compare", 0.0)
+        return {name: {**d, "mb_s": d["bytes"] / 1e6 / wall if wall else 0.0} for name, d in self.devices.items()}
+
+    def phase_stats(self):
+        stats = {}
+        for phase, values in sorted(self.phases.items()):
+            values = np.asarray(values)
+            stats[phase] = {"count": len(values), "total_s": float(values.sum()), "max_s": float(values.max()),
+                            **{f"p{q}_s": float(v) for q, v in zip(QUANTILES, np.percentile(values, QUANTILES))}}
+        return stats
+
+    def to_dict(self):
+        return {"run": self.run, "phases": self.phase_stats(), "sides": self.side_stats(),
+                "devices": self.device_stats(), "statuses": dict(self.statuses)}
+
+    def summary(self):
+        lines = ["", "Timing summary", "-"*60]
+        lines += [f"  {name:<14} {seconds:9.2f} s" for name, seconds in self.run.items()]
+        lines.append(f"  {'phase':<14} {'files':>7} {'total s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for phase, s in self.phase_stats().items():
+            lines.append(f"  {phase:<14} {s['count']:>7} {s['total_s']:>9.2f} {s['p50_s']*1e3:>8.1f} "
+                         f"{s['p90_s']*1e3:>8.1f} {s['p99_s']*1e3:>8.1f} {s['max_s']*1e3:>8.1f}")
+        for side, s in self.side_stats().items():
+            lines.append(f"  {side:<7} {s['bytes']/1e6:10.1f} MB read, {s['stream_mb_s']:7.1f} MB/s per stream, "
+                         f"{s['aggregate_mb_s']:7.1f} MB/s overall")
+        for name, d in self.device_stats().items():
+            cap = f"cap {d['cap_mb_s']:g} MB/s" if d["cap_mb_s"] else "no cap"
+            lines.append(f"  device {name:<7} {d['bytes']/1e6:10.1f} MB read, {d['mb_s']:7.1f} MB/s achieved "
+                         f"({d['readers']} readers, {cap})")
+        return "\n".join(lines)
+
+    def to_prometheus(self):
+        # node_exporter textfile collector format
+        out = ["# TYPE h5compare_run_seconds gauge"]
+        out += [f'h5compare_run_seconds{{phase="{name}"}} {seconds:.6f}' for name, seconds in self.run.items()]
+        out.append("# TYPE h5compare_phase_seconds summary")
+        for phase, s in self.phase_stats().items():
+            for q in QUANTILES:
+                out.append(f'h5compare_phase_seconds{{phase="{phase}",quantile="{q/100}"}} {s[f"p{q}_s"]:.6f}')
+            out.append(f'h5compare_phase_seconds_sum{{phase="{phase}"}} {s["total_s"]:.6f}')
+            out.append(f'h5compare_phase_seconds_count{{phase="{phase}"}} {s["count"]}')
+        out.append("# TYPE h5compare_read_bytes gauge")
+        out += [f'h5compare_read_bytes{{side="{side}"}} {s["bytes"]}' for side, s in self.side_stats().items()]
+        out.append("# TYPE h5compare_device_bytes gauge")
+        out += [f'h5compare_device_bytes{{device="{name}"}} {d["bytes"]}' for name, d in self.device_stats().items()]
+        out.append("# TYPE h5compare_device_mb_per_second gauge")
+        out += [f'h5compare_device_mb_per_second{{device="{name}"}} {d["mb_s"]:.3f}'
+                for name, d in self.device_stats().items()]
+        out.append("# TYPE h5compare_files gauge")
+        out += [f'h5compare_files{{status="{status}"}} {n}' for status, n in self.statuses.items()]
+        return "\n".join(out) + "\n"
+
+    def write(self, path):
+        # .prom -> Prometheus textfile, anything else -> JSON; replaced atomically so scrapers never see half a file
+        text = self.to_prometheus() if path.endswith(".prom") else json.dumps(self.to_dict(), indent=2)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
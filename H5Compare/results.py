@@ -0,0 +1,171 @@
+# H5Compare/results.py
+import json
+import os
+import sqlite3
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+
+# Per-file statuses, rendered as the "[TAG]" at the start of each report line
+OK             = "OK"
+DIFFERENT      = "DIFFERENT"
+DIFFERENT_SIZE = "DIFFERENT SIZE"
+MISSING_REMOTE = "MISSING on Remote"
+MISSING_LOCAL  = "MISSING on LOCAL"
+ERROR          = "ERROR"
+ABORTED        = "ABORTED"
+
+@dataclass
+class Result:
+    status: str
+    path: str
+    method: str = ""          # how the verdict was reached, e.g. "hash match", "deep match via Python"
+    detail: str = ""          # diff text or error message
+    bytes_read: int = 0       # bytes read from both sides (cache hits read nothing)
+    durations: dict = field(default_factory=dict)  # phase -> seconds
+    first_diff: str = None    # first differing location, e.g. "byte 1024" or "/img[0:10, 0:64]"
+    side_bytes: dict = field(default_factory=dict)  # "local"/"remote" -> bytes read from that side
+    diffs: list = field(default_factory=list)  # diffengine.Difference dicts from the deep comparison
+
+    def render(self):
+        # Same text as the tagged report lines
+        line = f"[{self.status}] {self.path}"
+        if self.status == ERROR:
+            return f"{line}: {self.detail}"
+        if self.method:
+            line += f" ({self.method})"
+        if self.first_diff and self.status == DIFFERENT:
+            line += f"\nFirst difference at {self.first_diff}"
+        if self.detail:
+            line += f"\n{self.detail}"
+        return line
+
+    __str__ = render
+
+    def add_time(self, phase, seconds):
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+
+class JsonlResultWriter:
+    # Appends one JSON object per result; every record carries the run id so past runs can be told apart
+    def __init__(self, path, run_info):
+        self.f = open(path, "a", encoding="utf-8", buffering=1024 * 1024)
+        self.run = run_info["run"]
+        self.f.write(json.dumps({"event": "run", **run_info}) + "\n")
+
+    def write(self, results):
+        self.f.write("".join(json.dumps({"run": self.run, **asdict(r)}) + "\n" for r in results))
+
+    def close(self):
+        self.f.close()
+
+class SqliteResultWriter:
+    # Batched inserts into a database that accumulates runs, e.g.
+    #   SELECT path, detail FROM results WHERE status = 'DIFFERENT' AND run = (SELECT max(run) FROM runs)
+    def __init__(self, path, run_info):
+        self.conn = sqlite3.connect(path, check_same_thread=False)  # <-- used by the log writer thread
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (run TEXT PRIMARY KEY, started TEXT, local_root TEXT, remote_root TEXT);
+            CREATE TABLE IF NOT EXISTS results (
+                run TEXT, status TEXT, path TEXT, method TEXT, detail TEXT,
+                bytes_read INTEGER, durations TEXT, first_diff TEXT, side_bytes TEXT, diffs TEXT);
+            CREATE INDEX IF NOT EXISTS results_run_status ON results (run, status);
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(results)")}
+        for column in ("side_bytes", "diffs"):
+            if column not in columns:  # <-- database from an older version
+                self.conn.execute(f"ALTER TABLE results ADD COLUMN {column} TEXT")
+        self.run = run_info["run"]
+        self.conn.execute("INSERT OR REPLACE INTO runs VALUES (:run, :started, :local_root, :remote_root)", run_info)
+        self.conn.commit()
+
+    def write(self, results):
+        self.conn.executemany(
+            "INSERT INTO results (run, status, path, method, detail, bytes_read, durations, first_diff, side_bytes, diffs) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(self.run, r.status, r.path, r.method, r.detail, r.bytes_read, json.dumps(r.durations),
+              r.first_diff, json.dumps(r.side_bytes), json.dumps(r.diffs)) for r in results])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def _root(root):
+    return root if "://" in root else os.path.abspath(root)
+
+def open_result_writer(path, local_root, remote_root):
+    # JSONL or SQLite by extension; None disables the structured stream
+    if not path:
+        return None
+    started = datetime.now()
+    run_info = {"run": started.strftime("%Y%m%dT%H%M%S%f"), "started": started.isoformat(timespec="seconds"),
+                "local_root": _root(local_root), "remote_root": _root(remote_root)}
+    if path.endswith((".sqlite", ".db")):
+        return SqliteResultWriter(path, run_info)
+    return JsonlResultWriter(path, run_info)
+
+# Verdicts that need no second look on --resume while both sides are unchanged; ERROR and
+# ABORTED files are compared again
+VERIFIED = (OK, DIFFERENT, DIFFERENT_SIZE, MISSING_REMOTE, MISSING_LOCAL)
+
+def _stat(rec):
+    return None if rec is None else [rec.size, rec.mtime_ns]
+
+class CheckpointJournal:
+    # Crash-safe record of the files finished so far: one JSON line per verified result with the
+    # size / mtime both sides had, written and fsync'd per log writer batch. A new run truncates it;
+    # with resume the entries for the same roots are loaded and the journal is appended to.
+    def __init__(self, path, local_root, remote_root, resume=False):
+        roots = {"local_root": _root(local_root), "remote_root": _root(remote_root)}
+        self.done = self.load(path, roots) if resume else None
+        self.resumed = self.done is not None
+        self.f = open(path, "a" if self.resumed else "w", encoding="utf-8")
+        if self.resumed:
+            self.f.write("\n")  # <-- ends a line cut short by a crash; blank lines are skipped on load
+        else:
+            self.done = {}
+            self.f.write(json.dumps({"event": "run", **roots}) + "\n")
+            self.sync()
+        self.local_files, self.remote_files = {}, {}
+
+    @staticmethod
+    def load(path, roots):
+        # rel_path -> (local stat, remote stat) of verified files, or None if there is nothing to resume
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return None
+        done = {}
+        for i, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # <-- last line cut short by the crash
+            if i == 0:
+                if entry.get("event") != "run" or {k: entry.get(k) for k in roots} != roots:
+                    return None
+            elif entry["status"] in VERIFIED:
+                done[entry["path"]] = (entry["local"], entry["remote"])
+            else:
+                done.pop(entry["path"], None)
+        return done if lines else None
+
+    def pending(self, local_files, remote_files):
+        # Paths still to compare: not in the journal, or changed on either side since
+        self.local_files, self.remote_files = local_files, remote_files
+        return {rel for rel in local_files.keys() | remote_files.keys()
+                if self.done.get(rel) != (_stat(local_files.get(rel)), _stat(remote_files.get(rel)))}
+
+    def write(self, results):
+        lines = [json.dumps({"path": r.path, "status": r.status, "local": _stat(self.local_files.get(r.path)),
+                             "remote": _stat(self.remote_files.get(r.path))}) + "\n"
+                 for r in results if r.status in VERIFIED]
+        if lines:
+            self.f.write("".join(lines))
+            self.sync()
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
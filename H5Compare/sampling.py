@@ -0,0 +1,107 @@
+# H5Compare/sampling.py
+import hashlib
+import math
+import time
+import numpy as np
+from .config import SAMPLE_RANGES, SAMPLE_HALF_LIFE_DAYS, SAMPLE_CONFIDENCE, HASH_BLOCK_MB
+from .results import DIFFERENT, DIFFERENT_SIZE, ERROR, ABORTED
+
+# Spot check (--sample=FRACTION): a seeded sample of the file pairs is verified, each sampled file
+# by a few random byte ranges (folder mode) instead of all of its bytes. UNIFORM_SHARE of the sample
+# is drawn uniformly and is what the confidence bound rests on; the rest favours recent changes
+# (a file changed today is up to 1 + RECENT_BOOST times as likely to be picked as an old one),
+# which finds fresh corruption sooner but says nothing about the population.
+UNIFORM_SHARE = 0.5
+RECENT_BOOST = 9
+RANGE_BYTES = HASH_BLOCK_MB * 1024 * 1024
+FAILED = (DIFFERENT, DIFFERENT_SIZE, ERROR)
+
+def file_rng(seed, rel_path):
+    # Per-file generator: the same ranges for a file whatever else is sampled or in which order
+    key = int.from_bytes(hashlib.md5(rel_path.replace("\\", "/").encode()).digest()[:8], "little")
+    return np.random.default_rng([seed, key])
+
+def sample_ranges(size, count, rng, range_bytes=RANGE_BYTES):
+    # count (start, length) block ranges, sorted; the first block (superblock, root group and
+    # usually most metadata) and the last are always among them
+    blocks = max(1, -(-size // range_bytes))
+    if blocks <= count:
+        picked = range(blocks)
+    else:
+        inner = rng.choice(np.arange(1, blocks - 1), max(0, count - 2), replace=False)
+        picked = sorted({0, blocks - 1, *map(int, inner)})
+    return [(b * range_bytes, min(range_bytes, size - b * range_bytes)) for b in picked]
+
+def sample_parts(parts, count, rng):
+    # Up to count random hyperslabs (diffengine.plan_parts) per dataset
+    by_dataset = {}
+    for part in parts:
+        by_dataset.setdefault(part[0], []).append(part)
+    picked = []
+    for dataset_parts in by_dataset.values():
+        index = rng.choice(len(dataset_parts), min(count, len(dataset_parts)), replace=False)
+        picked += [dataset_parts[i] for i in sorted(index)]
+    return picked
+
+def upper_bound(failures, n, confidence=SAMPLE_CONFIDENCE):
+    # One-sided Clopper-Pearson bound on the failure rate, by bisection on the binomial CDF
+    if n == 0 or failures >= n:
+        return 1.0
+    alpha = 1 - confidence
+
+    def cdf(p):
+        return sum(math.exp(math.lgamma(n + 1) - math.lgamma(i + 1) - math.lgamma(n - i + 1)
+                            + i * math.log(p) + (n - i) * math.log1p(-p)) for i in range(failures + 1))
+
+    lo, hi = 0.0, 1.0
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        lo, hi = (mid, hi) if cdf(mid) > alpha else (lo, mid)
+    return hi
+
+class Sample:
+    # jobs: (rel_path, rec_local, rec_remote) from pair_files; ranges = SAMPLE_RANGES, or 0 when
+    # sampled files are checked whole (manifest and agent digests)
+    def __init__(self, jobs, fraction, seed, ranges=SAMPLE_RANGES, half_life_days=SAMPLE_HALF_LIFE_DAYS, now=None):
+        self.population, self.fraction, self.seed, self.ranges = len(jobs), fraction, seed, ranges
+        now = time.time() if now is None else now
+        jobs = sorted(jobs)  # <-- same sample for the same tree and seed
+        n = min(len(jobs), max(1, round(len(jobs) * fraction))) if jobs else 0
+        n_uniform = min(n, math.ceil(n * UNIFORM_SHARE))
+        age_days = np.array([max(0.0, now - max(rec_local.mtime_ns, rec_remote.mtime_ns) / 1e9) / 86400
+                             for _, rec_local, rec_remote in jobs])
+        weights = 1 + RECENT_BOOST * 0.5 ** (age_days / half_life_days)
+        rng = np.random.default_rng(seed)
+        uniform = rng.choice(len(jobs), n_uniform, replace=False) if n_uniform else np.array([], dtype=int)
+        rest = np.setdiff1d(np.arange(len(jobs)), uniform)
+        weighted = rng.choice(rest, n - n_uniform, replace=False, p=weights[rest] / weights[rest].sum()) \
+            if n > n_uniform else []
+        self.jobs = [jobs[i] for i in sorted([*uniform, *weighted])]
+        self.uniform = {jobs[i][0] for i in uniform}  # <-- rel paths; RunMetrics counts their statuses apart
+
+        total = sum(rec_local.size for _, rec_local, _ in self.jobs)
+        if ranges:
+            read = sum(length for rel, rec_local, _ in self.jobs
+                       for _, length in sample_ranges(rec_local.size, ranges, file_rng(seed, rel)))
+        else:
+            read = total
+        self.coverage = read / total if total else 1.0
+
+    def describe(self):
+        return (f"[SAMPLE] Verifying {len(self.jobs)} of {self.population} file pairs "
+                f"({self.fraction:.1%}, seed {self.seed}; {len(self.uniform)} drawn uniformly, "
+                f"the rest favouring recently modified files), {self.coverage:.1%} of their bytes")
+
+    def summary(self, statuses, uniform_statuses):
+        # statuses: all sampled pairs; uniform_statuses: the uniformly drawn ones (RunMetrics)
+        if statuses[ABORTED]:
+            return "[SAMPLE] Interrupted; no confidence bound"
+        n, failures = len(self.jobs), sum(statuses[s] for s in FAILED)
+        n_uniform, uniform_failures = len(self.uniform), sum(uniform_statuses[s] for s in FAILED)
+        bound = upper_bound(uniform_failures, n_uniform)
+        where = " in the sampled byte ranges" if self.ranges else ""
+        return (f"\nSpot check (seed {self.seed}): {failures} of {n} sampled file pairs differ{where}.\n"
+                f"With {SAMPLE_CONFIDENCE:.0%} confidence fewer than {bound:.2%} of the {self.population} "
+                f"file pairs differ{where}, from the {n_uniform} pairs drawn uniformly "
+                f"({uniform_failures} differ); the recency-weighted picks are not counted in the bound.\n"
+                f"Rerun with --seed={self.seed} to repeat this sample; omit --sample for a full verify.")
@@ -0,0 +1,38 @@
+# H5Compare/scheduler.py
+from concurrent.futures import wait, FIRST_COMPLETED
+
+def file_cost(job):
+    # job = (rel_path, rec_local, rec_remote); bytes to read dominate the cost of a task
+    _, rec_local, rec_remote = job
+    return rec_local.size + rec_remote.size
+
+def largest_first(jobs, cost=file_cost):
+    # Big files start first so one of them can't be the last thing running
+    return sorted(jobs, key=cost, reverse=True)
+
+def bounded_map(executor, fn, jobs, max_in_flight):
+    # Submit fn(*job) keeping at most max_in_flight futures alive; yield results as they complete.
+    # max_in_flight may be a callable, read again before each refill.
+    jobs = iter(jobs)
+    in_flight = set()
+    limit = max_in_flight if callable(max_in_flight) else lambda: max_in_flight
+
+    def fill():
+        if len(in_flight) >= limit():
+            return
+        for job in jobs:
+            in_flight.add(executor.submit(fn, *job))
+            if len(in_flight) >= limit():
+                return
+
+    fill()
+    try:
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight.difference_update(done)
+            for future in done:
+                yield future.result()
+            fill()
+    finally:
+        for future in in_flight:
+            future.cancel()
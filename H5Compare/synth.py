@@ -0,0 +1,137 @@
+# H5Compare/synth.py
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import h5py
+
+from .config import RTOL, ATOL
+
+# Injected differences, applied to the remote copy, and the verdict diff_h5 should reach for each.
+# noise_within stays inside RTOL/ATOL, so bytes differ but the deep comparison reports a match.
+DIFF_KINDS = {
+    "byte_flip": "DIFFERENT",
+    "noise_within": "OK",
+    "noise_outside": "DIFFERENT",
+    "missing_dataset": "DIFFERENT",
+}
+DTYPES = ("f8", "f4", "i4", "i2")
+CORPUS_INFO = "corpus.json"
+
+def corpus_sizes(rng, files, min_mb, max_mb):
+    # Log-uniform: a few large files among many small ones, like an experiment folder
+    return np.exp(rng.uniform(np.log(min_mb), np.log(max_mb), files)) * 1024 * 1024
+
+def dataset_data(rng, dtype, nbytes):
+    n = max(1, int(nbytes) // np.dtype(dtype).itemsize)
+    if np.dtype(dtype).kind == "f":
+        return rng.standard_normal(n).cumsum().astype(dtype)  # <-- smooth, so compression has something to do
+    return rng.integers(-1000, 1000, n).astype(dtype)
+
+def write_file(path, rng, size_bytes, datasets, depth, chunks, compression):
+    # datasets split size_bytes between them; each sits depth groups down (random per dataset, up to depth)
+    names = []
+    with h5py.File(path, "w") as f:
+        f.attrs["generator"] = "H5Compare.synth"
+        for i in range(datasets):
+            group = "/".join(f"g{level}" for level in range(rng.integers(0, depth + 1)))
+            name = f"{group}/d{i}" if group else f"d{i}"
+            data = dataset_data(rng, DTYPES[i % len(DTYPES)], size_bytes / datasets)
+            if data.size > 1024:
+                data = data[:data.size // 64 * 64].reshape(-1, 64)
+            kwargs = {}
+            if chunks:
+                kwargs["chunks"] = (True if chunks == "auto" else
+                                    tuple(min(int(chunks), s) for s in data.shape[:1]) + data.shape[1:])
+            if compression:
+                kwargs["compression"] = compression
+            f.create_dataset(name, data=data, **kwargs)
+            names.append(name)
+    return names
+
+def inject(path, kind, rng):
+    # Returns the dataset that was changed
+    with h5py.File(path, "r+") as f:
+        names = []
+        f.visititems(lambda name, obj: names.append(name) if isinstance(obj, h5py.Dataset) else None)
+        # Noise of 0.01 * RTOL is below float32 precision and would leave an f4 dataset unchanged
+        doubles = [n for n in names if f[n].dtype == np.float64]
+        name = rng.choice(doubles if kind.startswith("noise") else names)  # <-- d0 is always f8 (DTYPES[0])
+        dset = f[name]
+        if kind == "missing_dataset":
+            del f[name]
+        elif kind == "byte_flip":
+            index = tuple(rng.integers(0, s) for s in dset.shape)
+            value = np.array([dset[index]], dtype=dset.dtype)
+            value.view(np.uint8)[-1] ^= 0x10  # <-- high byte on little-endian: never within tolerance
+            dset[index] = value[0]
+        else:
+            data = dset[...]
+            scale = 0.01 if kind == "noise_within" else 100.0
+            dset[...] = data + (np.abs(data) * RTOL + ATOL) * scale * rng.choice([-1, 1], data.shape)
+            assert not np.array_equal(dset[...], data), f"{kind} left {name} unchanged"
+    return name
+
+def generate(root, files=20, min_mb=0.5, max_mb=64, datasets=4, depth=2, chunks="auto", compression=None,
+             diff_fraction=0.25, seed=0):
+    # Builds root/local and root/remote (byte copies), then changes a fraction of the remote files.
+    # Everything is described in root/corpus.json for the benchmark to check verdicts against.
+    rng = np.random.default_rng(seed)
+    spec = {"files": files, "min_mb": min_mb, "max_mb": max_mb, "datasets": datasets, "depth": depth,
+            "chunks": chunks, "compression": compression, "diff_fraction": diff_fraction, "seed": seed}
+    local_root, remote_root = os.path.join(root, "local"), os.path.join(root, "remote")
+    kinds = list(DIFF_KINDS)
+    changed = rng.choice(files, int(round(files * diff_fraction)), replace=False)
+    diff_of = {int(i): kinds[n % len(kinds)] for n, i in enumerate(changed)}  # <-- every kind gets used
+    info = {"spec": spec, "files": {}}
+
+    for i, size in enumerate(corpus_sizes(rng, files, min_mb, max_mb)):
+        rel = os.path.join(*[f"run{j}" for j in range(i % (depth + 1))], f"file{i:05d}.h5")
+        f_local, f_remote = os.path.join(local_root, rel), os.path.join(remote_root, rel)
+        os.makedirs(os.path.dirname(f_local), exist_ok=True)
+        os.makedirs(os.path.dirname(f_remote), exist_ok=True)
+        write_file(f_local, rng, size, datasets, depth, chunks, compression)
+        shutil.copyfile(f_local, f_remote)
+
+        entry = {"size": os.path.getsize(f_local), "diff": None, "expected": "OK"}
+        if i in diff_of:
+            kind = diff_of[i]
+            entry.update(diff=kind, dataset=inject(f_remote, kind, rng), expected=DIFF_KINDS[kind])
+        info["files"][rel] = entry
+
+    with open(os.path.join(root, CORPUS_INFO), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=1)
+    return info
+
+def load_corpus(root):
+    with open(os.path.join(root, CORPUS_INFO), encoding="utf-8") as f:
+        return json.load(f)
+
+def add_corpus_args(parser):
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--min-mb", type=float, default=0.5)
+    parser.add_argument("--max-mb", type=float, default=64)
+    parser.add_argument("--datasets", type=int, default=4, help="datasets per file")
+    parser.add_argument("--depth", type=int, default=2, help="maximum group / folder nesting")
+    parser.add_argument("--chunks", default="auto", help="auto, rows per chunk, or '' for contiguous")
+    parser.add_argument("--compression", default=None, choices=[None, "gzip", "lzf"])
+    parser.add_argument("--diff-fraction", type=float, default=0.25, help="share of remote files changed")
+    parser.add_argument("--seed", type=int, default=0)
+
+def corpus_kwargs(args):
+    return {"files": args.files, "min_mb": args.min_mb, "max_mb": args.max_mb, "datasets": args.datasets,
+            "depth": args.depth, "chunks": args.chunks, "compression": args.compression,
+            "diff_fraction": args.diff_fraction, "seed": args.seed}
+
+if __name__ == "__main__":
+    # python -m H5Compare.synth <root> [--files=N ...]  ->  <root>/local, <root>/remote, <root>/corpus.json
+    parser = argparse.ArgumentParser(description="Generate a paired local/remote HDF5 test corpus")
+    parser.add_argument("root")
+    add_corpus_args(parser)
+    args = parser.parse_args()
+    info = generate(args.root, **corpus_kwargs(args))
+    total = sum(e["size"] for e in info["files"].values())
+    diffs = sum(e["diff"] is not None for e in info["files"].values())
+    print(f"{len(info['files'])} file pairs, {total / 1e6:.1f} MB per side, {diffs} remote files changed "
+          f"-> {os.path.join(args.root, CORPUS_INFO)}")
@@ -0,0 +1,14 @@
+# H5Compare/tests/conftest.py
+import pytest
+
+from H5Compare import abort_flag
+from H5Compare.main import process_pool
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))  # <-- spawned workers keep their hash cache here
+    abort_flag.clear()
+    executor = process_pool()
+    yield executor
+    abort_flag.clear()
+    executor.shutdown(cancel_futures=True)
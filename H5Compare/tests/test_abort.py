@@ -0,0 +1,52 @@
+# H5Compare/tests/test_abort.py
+# Run from the repository root: python -m pytest -q H5Compare/tests
+import os
+import time
+from concurrent.futures import wait
+import h5py
+
+from H5Compare import abort_flag
+from H5Compare.comparator import deep_compare_task
+from H5Compare.results import ABORTED
+from H5Compare.utils import file_hash
+
+LOGICAL_GB = 2     # dataset size and sparse file size; neither takes real disk space
+ABORT_AFTER_S = 1.5
+DEADLINE_S = 3.0  # one block read / compare plus the result's trip back
+
+def write_pair(root):
+    # Chunked datasets with no chunk written, different fill values: every element differs and
+    # the deep stage reads (fills) and compares all of them, from files of a few kB
+    rows = LOGICAL_GB * 1024**3 // 8 // 1024
+    paths = []
+    for name, fill in (("local.h5", 0.0), ("remote.h5", 1.0)):
+        path = os.path.join(root, name)
+        with h5py.File(path, "w") as f:
+            f.create_dataset("data", shape=(rows, 1024), dtype="f8", chunks=(256, 1024), fillvalue=fill)
+        paths.append(path)
+    return paths
+
+def write_sparse(root):
+    path = os.path.join(root, "sparse.bin")
+    with open(path, "wb") as f:
+        f.truncate(LOGICAL_GB * 1024**3)
+    return path
+
+def test_abort_stops_running_workers(tmp_path, pool):
+    f_local, f_remote = write_pair(str(tmp_path))
+    sparse = write_sparse(str(tmp_path))
+    # Start the workers first so the timing below covers the tasks, not interpreter start-up
+    wait([pool.submit(os.getpid) for _ in range(2)])
+
+    deep = pool.submit(deep_compare_task, "pair.h5", f_local, f_remote)
+    hashing = pool.submit(file_hash, sparse)
+    time.sleep(ABORT_AFTER_S)
+    assert not deep.done() and not hashing.done(), "tasks finished before the abort; raise LOGICAL_GB"
+
+    abort_flag.set()
+    start = time.perf_counter()
+    done, _ = wait([deep, hashing], timeout=DEADLINE_S)
+    assert len(done) == 2, f"workers still running {DEADLINE_S} s after abort"
+    assert time.perf_counter() - start < DEADLINE_S
+    assert deep.result().status == ABORTED
+    assert isinstance(hashing.exception(), abort_flag.Aborted)
@@ -0,0 +1,34 @@
+# H5Compare/tests/test_digests.py
+# Run from the repository root: python -m pytest -q H5Compare/tests
+import os
+import h5py
+import numpy as np
+
+from H5Compare import devices
+from H5Compare.comparator import deep_compare_task
+from H5Compare.results import OK
+
+def write_repacked(root):
+    # Same content, other chunking and compression: the bytes differ, the datasets do not
+    data = np.random.default_rng(0).random((512, 256))
+    paths = []
+    for name, chunks, compression in (("local.h5", (64, 256), None), ("remote.h5", (32, 32), "gzip")):
+        path = os.path.join(root, name)
+        with h5py.File(path, "w") as f:
+            f.create_dataset("g/data", data=data, chunks=chunks, compression=compression)
+            f.create_dataset("g/ids", data=np.arange(1000), compression=compression)
+        paths.append(path)
+    return paths
+
+def test_second_run_compares_digests_not_payload(tmp_path, pool):
+    f_local, f_remote = write_repacked(str(tmp_path))
+    start = devices.bytes_read()
+    first = pool.submit(deep_compare_task, "pair.h5", f_local, f_remote).result()
+    assert (first.status, first.method) == (OK, "deep match via Python")
+    assert "digest" in first.durations  # <-- both sides' digests cached after the payload comparison
+
+    before = devices.bytes_read()
+    assert before != start  # <-- the first run's reads are counted
+    second = pool.submit(deep_compare_task, "pair.h5", f_local, f_remote).result()
+    assert (second.status, second.method) == (OK, "dataset digests match")
+    assert devices.bytes_read() == before, "payload read again on the second run"
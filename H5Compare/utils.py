@@ -1,53 +1,385 @@
 # H5Compare/utils.py
 import hashlib
+import itertools
+import math
+import mmap
 import os
 import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from contextlib import nullcontext
+from queue import Queue
+from threading import Thread, Event
 import h5py
 import numpy as np
-from .config import HASH_ALGO, RTOL, ATOL, USE_H5DIFF
+from H5Compare import abort_flag  # <-- checked once per block
+from .config import HASH_ALGO, HASH_BLOCK_MB, MEMORY_BUDGET_MB, RAW_CHUNK_COMPARE, WALK_WORKERS, IO_THREADS, SPLIT_MB, SEGMENT_MB
+from .devices import DEVICES  # <-- per-side read slots and bandwidth caps, shared with the process pool
 
-def file_hash(path, algo=HASH_ALGO, block_size=4*1024*1024):
-    h = hashlib.new(algo)
+BLOCK_SIZE = HASH_BLOCK_MB * 1024 * 1024
+
+SPLIT_BYTES, SEGMENT_BYTES = SPLIT_MB * 1024 * 1024, SEGMENT_MB * 1024 * 1024
+_segment_pools = {}  # <-- byte ranges of large files; their tasks never wait on other tasks
+
+def segment_pool(side=None):
+    # One pool per device, sized to its readers, so segments queued for one side never hold the
+    # threads the other side's segments need; side None (both devices at once) gets a shared pool
+    if side not in _segment_pools:
+        workers = DEVICES[side].readers if side else IO_THREADS
+        _segment_pools[side] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"segment-{side or 'pair'}")
+    return _segment_pools[side]
+
+def segments(size, segment_bytes=SEGMENT_BYTES):
+    # (start, length) byte ranges covering a file, aligned to whole read blocks
+    segment_bytes = max(BLOCK_SIZE, segment_bytes // BLOCK_SIZE * BLOCK_SIZE)
+    return [(start, min(segment_bytes, size - start)) for start in range(0, size, segment_bytes)]
+
+def open_sequential(path):
+    # Unbuffered, so readinto() lands directly in our buffer; hint the OS to read ahead
+    f = open(path, "rb", buffering=0)
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+    return f
+
+def readinto_full(f, view):
+    # Raw reads may come back short (SMB, pipes); keep blocks full so both sides stay aligned
+    total = 0
+    while total < len(view):
+        n = f.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+def mmap_blocks(path, block_size=BLOCK_SIZE, device=None):
     with open(path, "rb") as f:
-        while chunk := f.read(block_size):
-            h.update(chunk)
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as view:
+                for start in range(0, len(mm), block_size):
+                    abort_flag.check()
+                    block = view[start:start + block_size]
+                    if device is not None:
+                        device.take(len(block))
+                    try:
+                        yield block
+                    finally:
+                        block.release()  # <-- mmap cannot close while views are exported
+
+def read_blocks(path, block_size=BLOCK_SIZE, depth=2, start=0, length=None, device=None):
+    # A background thread reads into `depth` recycled buffers while the caller consumes
+    # the previous block (double buffering). Each yielded view is only valid until the next one.
+    # start / length restrict reading to a byte range; device (devices.Device) counts and caps the reads.
+    free, full = Queue(), Queue()
+    for _ in range(depth):
+        free.put(bytearray(block_size))
+    stop = Event()
+
+    def reader():
+        remaining = length
+        try:
+            with open_sequential(path) as f:
+                f.seek(start)
+                while not stop.is_set():
+                    buf = free.get()
+                    if buf is None:
+                        return
+                    view = memoryview(buf) if remaining is None else memoryview(buf)[:min(block_size, remaining)]
+                    n = readinto_full(f, view)
+                    if device is not None and n:
+                        device.take(n)
+                    if remaining is not None:
+                        remaining -= n
+                    full.put((buf, n))
+                    if n == 0:
+                        return
+        except BaseException as e:
+            full.put(e)
+
+    t = Thread(target=reader, daemon=True)
+    t.start()
+    try:
+        while True:
+            item = full.get()
+            if isinstance(item, BaseException):
+                raise item
+            buf, n = item
+            if n == 0:
+                return
+            abort_flag.check()
+            yield memoryview(buf)[:n]
+            free.put(buf)
+    finally:
+        stop.set()
+        free.put(None)
+        t.join()
+
+def file_hash(path, algo=HASH_ALGO, block_size=BLOCK_SIZE, use_mmap=False, device=None):
+    h = hashlib.new(algo)
+    blocks = mmap_blocks(path, block_size, device) if use_mmap else read_blocks(path, block_size, device=device)
+    for block in blocks:
+        h.update(block)
     return h.hexdigest()
 
-def run_h5diff(file1, file2):
+def range_hash(path, start, length, algo=HASH_ALGO, side=None):
+    # Digest of one byte range; holds a read slot of `side` while reading
+    device = DEVICES[side] if side else None
+    with device or nullcontext():
+        h = hashlib.new(algo)
+        for block in read_blocks(path, start=start, length=length, device=device):
+            h.update(block)
+        return h.hexdigest()
+
+def tree_hash(path, algo=HASH_ALGO, side=None, segment_bytes=SEGMENT_BYTES):
+    # Hash of the segment digests, the segments hashed in parallel. Not equal to file_hash of the
+    # same file: both sides of a comparison must use it, which the size check guarantees.
+    size = os.path.getsize(path)
+    pool = segment_pool(side)
+    futures = [pool.submit(range_hash, path, start, length, algo, side) for start, length in segments(size, segment_bytes)]
     try:
-        result = subprocess.run(["h5diff", file1, file2], capture_output=True, text=True)
-        if result.returncode == 0:
-            return True
-        else:
-            return f"[DIFF] {file1} vs {file2}\n{result.stdout}{result.stderr}"
+        h = hashlib.new(algo)
+        h.update(f"tree|{size}|{segment_bytes}|".encode())
+        for future in futures:
+            h.update(bytes.fromhex(future.result()))
+        return h.hexdigest()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def run_pair(job1, job2):
+    # Run both jobs concurrently so local and remote storage are busy at the same time
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        second = ex.submit(job2)
+        return job1(), second.result()
+
+def hash_pair(file1, file2, algo=HASH_ALGO, block_size=BLOCK_SIZE):
+    return run_pair(lambda: file_hash(file1, algo, block_size), lambda: file_hash(file2, algo, block_size))
+
+def direct_compare(file1, file2, block_size=BLOCK_SIZE, start=0, length=None, devices=(None, None)):
+    # Read both files in lockstep; return offset of first differing byte, or None if identical
+    offset = start
+    blocks1 = read_blocks(file1, block_size, start=start, length=length, device=devices[0])
+    blocks2 = read_blocks(file2, block_size, start=start, length=length, device=devices[1])
+    try:
+        for b1, b2 in itertools.zip_longest(blocks1, blocks2, fillvalue=b""):
+            a1, a2 = np.frombuffer(b1, np.uint8), np.frombuffer(b2, np.uint8)
+            if a1.size != a2.size or not np.array_equal(a1, a2):  # numpy is ~10x faster than memoryview ==
+                n = min(a1.size, a2.size)
+                diff = np.flatnonzero(a1[:n] != a2[:n])
+                return offset + (int(diff[0]) if diff.size else n)
+            offset += a1.size
+        return None
+    finally:
+        blocks1.close()
+        blocks2.close()
+
+def compare_range(file1, file2, start, length):
+    # file1 is on the local side, file2 on the remote
+    with DEVICES["local"] as local, DEVICES["remote"] as remote:  # <-- always local first, no deadlock
+        return direct_compare(file1, file2, start=start, length=length, devices=(local, remote))
+
+def split_direct_compare(file1, file2, segment_bytes=SEGMENT_BYTES):
+    # direct_compare with the segments of a large file compared in parallel; once a difference
+    # is found, only segments before it still matter
+    futures = {segment_pool().submit(compare_range, file1, file2, start, length): start
+               for start, length in segments(os.path.getsize(file1), segment_bytes)}
+    first = None
+    try:
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            offset = future.result()
+            if offset is not None and (first is None or offset < first):
+                first = offset
+                for other, start in futures.items():
+                    if start > first:
+                        other.cancel()
+            if first is not None and all(f.done() for f, start in futures.items() if start < first):
+                break
+        return first
+    finally:
+        for future in futures:
+            future.cancel()
+
+def run_h5diff(file1, file2, poll_s=0.2):
+    try:
+        proc = subprocess.Popen(["h5diff", file1, file2], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     except FileNotFoundError:
         return None
+    while True:
+        try:
+            stdout, stderr = proc.communicate(timeout=poll_s)
+            break
+        except subprocess.TimeoutExpired:
+            if abort_flag.is_set():
+                proc.kill()
+                proc.communicate()
+                raise abort_flag.Aborted()
+    if proc.returncode == 0:
+        return True
+    else:
+        return f"[DIFF] {file1} vs {file2}\n{stdout}{stderr}"
+
+def block_shape(shape, itemsize, chunks=None, budget_bytes=MEMORY_BUDGET_MB*1024*1024):
+    # Largest hyperslab aligned to the chunk grid that fits the budget, grown from the
+    # innermost axis outwards so every read covers whole chunks (or whole rows if contiguous)
+    block = list(chunks or (1,) * len(shape))
+    for axis in reversed(range(len(shape))):
+        rest = math.prod(block[:axis] + block[axis+1:]) * itemsize
+        fit = max(block[axis], (budget_bytes // max(rest, 1)) // block[axis] * block[axis])
+        if fit < shape[axis]:
+            block[axis] = fit
+            break
+        block[axis] = max(shape[axis], 1)  # <-- a zero-length axis still needs a non-zero step
+    return tuple(block)
+
+def iter_blocks(shape, block):
+    # No blocks at all for an empty dataset
+    starts = [range(0, n, max(b, 1)) for n, b in zip(shape, block)]
+    for corner in itertools.product(*starts):
+        yield tuple(slice(c, min(c + b, n)) for c, b, n in zip(corner, block, shape))
+
+def filter_pipeline(dset):
+    # (filter id, parameters) per stage; names are skipped as they vary between library versions
+    plist = dset.id.get_create_plist()
+    return tuple(plist.get_filter(i)[0::2] for i in range(plist.get_nfilters()))
+
+def raw_chunks_comparable(d1, d2):
+    return (RAW_CHUNK_COMPARE and hasattr(d1.id, "get_chunk_info_by_coord")
+            and d1.chunks is not None and d1.chunks == d2.chunks
+            and d1.dtype == d2.dtype and filter_pipeline(d1) == filter_pipeline(d2))
+
+def same_raw_chunk(d1, d2, offset):
+    # Identical stored bytes under an identical filter pipeline mean identical data
+    # (d1 local, d2 remote: the stored bytes are read under those devices' limits)
+    info1, info2 = d1.id.get_chunk_info_by_coord(offset), d2.id.get_chunk_info_by_coord(offset)
+    if info1.byte_offset is None or info2.byte_offset is None or info1.size != info2.size:
+        return False
+    raw = []
+    for d, side in ((d1, "local"), (d2, "remote")):
+        with DEVICES[side]:
+            raw.append(d.id.read_direct_chunk(offset))  # <-- (filter mask, bytes)
+        DEVICES[side].take(info1.size)
+    return raw[0] == raw[1]
+
+# Metadata-only view of a file: one node per object path, read from headers without touching payload.
+# dtype is byte-order normalised; chunks and filters describe the layout, which does not change content.
+StructNode = namedtuple("StructNode", "kind shape dtype chunks filters attrs")
+
+def _text(item):
+    # Fixed-length and variable-length strings read back as bytes or str depending on how they were written
+    if isinstance(item, bytes):
+        return item.decode("utf-8", "surrogateescape")
+    if isinstance(item, list):
+        return [_text(i) for i in item]
+    return item
+
+def attr_token(value):
+    # Comparable, printable form of an attribute value (NaN equals NaN, byte order and width ignored,
+    # b"abc" equals "abc")
+    return repr(_text(np.asarray(value).tolist()))
+
+def structure(f):
+    def node(obj):
+        attrs = tuple(sorted((k, attr_token(v)) for k, v in obj.attrs.items()))
+        if isinstance(obj, h5py.Dataset):
+            return StructNode("dataset", obj.shape, str(obj.dtype.newbyteorder("<")),  # <-- also fields of compounds
+                              obj.chunks, filter_pipeline(obj), attrs)
+        kind = "group" if isinstance(obj, h5py.Group) else "datatype"
+        return StructNode(kind, None, None, None, None, attrs)
+
+    nodes = {"/": node(f)}
+    f.visititems(lambda name, obj: nodes.__setitem__("/" + name, node(obj)))
+    return nodes
+
+def dataset_digest(dset, algo=HASH_ALGO, budget_mb=MEMORY_BUDGET_MB):
+    # Digest of the logical content (dtype, shape, values in C order), independent of chunking,
+    # compression and byte order. Equal digests mean bit-identical data, not RTOL/ATOL closeness.
+    h = hashlib.new(algo)
+    dtype = dset.dtype.newbyteorder("<") if dset.dtype.byteorder in "<>=" else dset.dtype
+    h.update(f"{dtype.str}|{dset.shape}|".encode())
+    if dset.shape is None:
+        return h.hexdigest()
+    if dset.ndim == 0:
+        blocks = [np.asarray(dset[()], dtype=dset.dtype)]
+    else:
+        # chunks=None gives [1, .., 1, k, full, .., full] blocks, i.e. consecutive C-order runs
+        block = block_shape(dset.shape, dset.dtype.itemsize, None, budget_mb * 1024 * 1024 // 2)
+        blocks = (dset[sel] for sel in iter_blocks(dset.shape, block))
+    for data in blocks:
+        abort_flag.check()
+        if dset.dtype.kind == "O":
+            for item in data.flat:
+                h.update(item if isinstance(item, bytes) else str(item).encode())
+                h.update(b"\0")
+        else:
+            h.update(np.ascontiguousarray(data, dtype=dtype))
+    return h.hexdigest()
+
+def h5_digests(path, algo=HASH_ALGO):
+    # {"/group/dataset": digest} for every dataset in the file
+    digests = {}
+    with h5py.File(path, "r") as f:
+        def visit(name, obj):
+            if isinstance(obj, h5py.Dataset):
+                digests["/" + name] = dataset_digest(obj, algo)
+        f.visititems(visit)
+    return digests
+
+def compare_digests(digests1, digests2, name2="remote"):
+    # First difference between two {dataset: digest} tables, or None
+    for key in sorted(digests1):
+        if key not in digests2:
+            return f"Missing in {name2}: {key}"
+        if digests1[key] != digests2[key]:
+            return f"Dataset differs: {key} (content digest)"
+    for key in sorted(digests2):
+        if key not in digests1:
+            return f"Extra in {name2}: {key}"
+    return None
+
+FileRecord = namedtuple("FileRecord", "path size mtime_ns inode")
+
+def stat_key(st):
+    # (size, mtime, inode); Windows scandir reports no inode, so it is left out there on both paths
+    return st.st_size, st.st_mtime_ns, (st.st_ino if os.name != "nt" else 0)
+
+def file_record(path):
+    return FileRecord(path, *stat_key(os.stat(path)))
+
+def scan_dir(dirpath, prefix_len):
+    files, subdirs = {}, []
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith(".h5") and entry.is_file():
+                        files[entry.path[prefix_len:]] = FileRecord(entry.path, *stat_key(entry.stat()))
+                except OSError:
+                    pass  # <-- vanished mid-walk; the rest of the folder is still listed
+    except OSError:
+        pass  # <-- unreadable folders are skipped, as os.walk did
+    return files, subdirs
 
-def compare_h5(file1, file2, rtol=RTOL, atol=ATOL):
-    with h5py.File(file1, 'r') as f1, h5py.File(file2, 'r') as f2:
-        def compare_groups(g1, g2, path=""):
-            for key in g1.keys():
-                if key not in g2:
-                    return f"Missing in {file2}: {path}/{key}"
-                if isinstance(g1[key], h5py.Dataset):
-                    d1, d2 = g1[key][()], g2[key][()]
-                    if not np.allclose(d1, d2, rtol=rtol, atol=atol, equal_nan=True):
-                        return f"Dataset differs: {path}/{key}"
-                else:
-                    msg = compare_groups(g1[key], g2[key], path + "/" + key)
-                    if msg:
-                        return msg
-            for key in g2.keys():
-                if key not in g1:
-                    return f"Extra in {file2}: {path}/{key}"
-            return None
-        return compare_groups(f1, f2)
-
-def collect_h5_files(root):
+def collect_h5_files(root, workers=WALK_WORKERS):
+    # One scandir pass per folder, folders scanned in parallel; stat data is captured once
+    # here and reused by the pre-check, the comparator and the cache
+    prefix_len = len(os.path.join(root, ""))
     h5_files = {}
-    for dirpath, _, filenames in os.walk(root):
-        for f in filenames:
-            if f.endswith(".h5"):
-                rel_path = os.path.relpath(os.path.join(dirpath, f), root)
-                h5_files[rel_path] = os.path.join(dirpath, f)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        pending = {ex.submit(scan_dir, root, prefix_len)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                h5_files.update(files)
+                pending |= {ex.submit(scan_dir, d, prefix_len) for d in subdirs}
     return h5_files
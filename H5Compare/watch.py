@@ -0,0 +1,145 @@
+# H5Compare/watch.py
+import sys, os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from queue import Queue
+from threading import Lock, Thread
+
+# Ensure parent folder is in sys.path so absolute imports work
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from H5Compare import abort_flag  # <-- shared abort flag
+from H5Compare.config import (LOCAL_ROOT, REMOTE_ROOT, IO_THREADS, REPORT_FILE, RESULTS_FILE,
+                              WATCH_POLL_S, WATCH_SETTLE_S)
+from H5Compare.utils import collect_h5_files, file_record
+from H5Compare.logger import log_writer
+from H5Compare.results import open_result_writer
+from H5Compare.main import pair_files, compare_jobs, process_pool
+
+try:
+    from watchdog.observers import Observer  # optional: inotify / ReadDirectoryChangesW / FSEvents
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
+WRITE_EVENTS = ("created", "modified", "moved", "deleted", "closed")
+
+class PollingWatcher:
+    # mtime polling fallback: one scandir walk per poll, diffed against the last known records
+    def __init__(self, root):
+        self.root = root
+        self.records = collect_h5_files(root)
+
+    def changes(self):
+        current = collect_h5_files(self.root)
+        changed = {rel for rel, rec in current.items() if self.records.get(rel) != rec}
+        changed |= self.records.keys() - current.keys()
+        self.records = current
+        return changed
+
+    def refresh(self, rel):
+        # Stat one path again; its record, or None once it is gone
+        try:
+            self.records[rel] = file_record(os.path.join(self.root, rel))
+        except OSError:
+            self.records.pop(rel, None)
+        return self.records.get(rel)
+
+    def stop(self):
+        pass
+
+class EventWatcher(PollingWatcher):
+    # Filesystem notifications; only paths named in events are stat-ed again
+    def __init__(self, root):
+        super().__init__(root)
+        self.pending, self.rescan, self.lock = set(), False, Lock()
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type not in WRITE_EVENTS:
+                    return  # <-- our own reads raise opened / closed_no_write events
+                with watcher.lock:
+                    if event.is_directory and event.event_type in ("moved", "deleted"):
+                        watcher.rescan = True  # <-- a whole folder moved; cheaper to walk than guess
+                    for path in (event.src_path, getattr(event, "dest_path", "")):
+                        if path.endswith(".h5"):
+                            watcher.pending.add(os.path.relpath(path, watcher.root))
+
+        self.observer = Observer()
+        self.observer.schedule(Handler(), root, recursive=True)
+        self.observer.start()
+
+    def changes(self):
+        with self.lock:
+            pending, rescan = self.pending, self.rescan
+            self.pending, self.rescan = set(), False
+        if rescan:
+            return super().changes() | pending
+        for rel in pending:
+            self.refresh(rel)
+        return pending
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
+
+def make_watcher(root):
+    return EventWatcher(root) if Observer is not None else PollingWatcher(root)
+
+def watch(local_root=LOCAL_ROOT, remote_root=REMOTE_ROOT, poll_s=WATCH_POLL_S, settle_s=WATCH_SETTLE_S):
+    q = Queue()
+    with open(REPORT_FILE, "a", encoding="utf-8") as f:
+        f.write(f"HDF5 Comparison Watch\nStarted: {datetime.now()}\n")
+        f.write("="*60 + "\n")
+
+    result_writer = open_result_writer(RESULTS_FILE, local_root, remote_root)
+    writer_thread = Thread(target=log_writer, args=(q, REPORT_FILE, result_writer), daemon=True)
+    writer_thread.start()
+
+    local, remote = make_watcher(local_root), make_watcher(remote_root)
+    # rel_path -> time a change was last seen; the first pass treats every file as changed
+    pending = dict.fromkeys(local.records.keys() | remote.records.keys(), 0.0)
+
+    # Pools stay warm for the whole session
+    io_pool  = ThreadPoolExecutor(max_workers=IO_THREADS)
+    cpu_pool = process_pool()
+    try:
+        while not abort_flag.is_set():
+            now = time.time()
+            for rel in local.changes() | remote.changes():
+                pending[rel] = now
+
+            # Debounce: skip files changed within settle_s, or still being written on either side
+            ready = set()
+            for rel, seen in pending.items():
+                mtimes = [r.mtime_ns / 1e9 for r in (local.records.get(rel), remote.records.get(rel)) if r]
+                if now - seen >= settle_s and now - max(mtimes, default=0) >= settle_s:
+                    ready.add(rel)
+
+            if ready:
+                for rel in ready:
+                    del pending[rel]
+                # An event names one side only; the other side's record may be just as old
+                for rel in list(ready):
+                    rec_local, rec_remote = local.refresh(rel), remote.refresh(rel)
+                    if rec_local is None and rec_remote is None:
+                        ready.discard(rel)  # <-- deleted on both sides, nothing to compare
+                jobs = pair_files(local.records, remote.records, q, ready)
+                compare_jobs(jobs, q, io_pool, cpu_pool)
+                q.put(f"[WATCH] {datetime.now():%H:%M:%S} re-checked {len(ready)} file(s), "
+                      f"{len(pending)} waiting to settle")
+
+            time.sleep(poll_s if Observer is None else 1)
+    finally:
+        local.stop()
+        remote.stop()
+        io_pool.shutdown(wait=False, cancel_futures=True)
+        cpu_pool.shutdown(wait=False, cancel_futures=True)
+        q.put("[ABORTED] Watch stopped by user")
+        q.put("__DONE__")
+        writer_thread.join()
+
+if __name__ == "__main__":
+    watch()